@@ -1,33 +1,20 @@
 #!/usr/bin/env python3
 
 from html.parser import HTMLParser
+import codecs
 from collections import OrderedDict
 import logging
 import html
+import re
+import sys
 from dataclasses import dataclass, field
-from typing import TypeVar, Optional, List
+from typing import Iterable, TypeVar, Optional, List
 
-HtmlAttribute = tuple[str, str | None]  # (key, value) where value can be None
-TagTuple = tuple[str, List[HtmlAttribute]]
-
-
-def attributes_to_str(attrs: list[HtmlAttribute]) -> str:
-    """Reconstruct attributes list (list of (k,v) tuples) into a string for a start tag."""
-    if not attrs:
-        return ""
-    parts = []
-    for k, v in attrs:
-        if v is None:
-            parts.append(k)
-        else:
-            # escape quotes in attribute values
-            parts.append(f'{k}="{html.escape(v, quote=True)}"')
-    return " " + " ".join(parts)
+from .constants import DEFAULT_PARSER
 
+HtmlAttribute = tuple[str, str | None]  # (key, value) where value can be None
+StackEntry = tuple[str, str]  # (tag, start tag text as it appears in the document)
 
-def open_tag_str(tag_tuple: tuple[str, list[HtmlAttribute]]) -> str:
-    tag, attrs = tag_tuple
-    return f"<{tag}{attributes_to_str(attrs)}>"
 
 def close_tag_str(tag: str) -> str:
     return f"</{tag}>"
@@ -51,44 +38,43 @@ def find_common_prefix(list_of_lists: list[list[T]]) -> list[T]:
             break
     return prefix
 
-@dataclass
+@dataclass(slots=True)
 class Annotation:
     color: Optional[str]
-    context: List[TagTuple]
-    text: str
-    pending_open_context: List[TagTuple] = field(default_factory=list)
+    context: List[StackEntry]  # open tags, starting at the innermost <section> (if any)
+    parts: List[str] = field(default_factory=list)  # joined once the document is parsed
+    pending_open_context: List[StackEntry] = field(default_factory=list)
     first_index: int = 0
 
-def last_or_none(d: OrderedDict[str, T]) -> Optional[tuple[str, T]]:
-    """Return the last value in the OrderedDict or None if empty."""
-    return next(reversed(d.items())) if d else None
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
 
-def ctx_up_to_section(stack: list[TagTuple]) -> list[TagTuple]:
-    """Return the context up to the last <section> tag in the stack."""
-    sec_index = -1
-    for i in range(len(stack)-1, -1, -1):
-        if stack[i][0] == "section":
-            sec_index = i
-            break
-    return stack[sec_index+1 :] if sec_index != -1 else stack[:]
+# bump whenever a change makes the extracted annotations differ, so cached results are discarded
+EXTRACTOR_VERSION = 2
 
 class ReadeckExtractor(HTMLParser):
     def __init__(self):
         super().__init__(convert_charrefs=False)  # we will handle charrefs/entities ourselves
-        self.stack: list[tuple[str, list[HtmlAttribute]]] = []  # stack of (tag, attrs_list)
+        self.stack: list[StackEntry] = []  # stack of (tag, start tag text)
+        self.section_indices: list[int] = []  # positions of the <section> tags in self.stack
         self.annotations: OrderedDict[str, Annotation] = OrderedDict()  # id -> Annotation
         self.order_counter = 0
+        self._last_ann: Optional[Annotation] = None  # most recently added annotation
 
         # annotation parsing state
         self._inside_rd = False
         self._current_ann_id = None
-        self._current_ann_color = None
         self._current_ann_text_parts = []
 
     def handle_starttag(self, tag, attrs):
-        attrs = list(attrs)  # list of (k, v)
-        # push to stack
-        self.stack.append((tag, attrs))
+        # push to stack; the original start tag text is emitted as-is for tags that end up in an
+        # annotation, which is cheaper (and more faithful) than re-serializing the attributes
+        tag = sys.intern(tag)
+        entry = (tag, self.get_starttag_text())
+        if tag == "section":
+            self.section_indices.append(len(self.stack))
+        self.stack.append(entry)
 
         if tag != "rd-annotation":
             # If we are inside an rd-annotation and a new start tag appears -> error
@@ -99,11 +85,8 @@ class ReadeckExtractor(HTMLParser):
                     tag,
                     self._current_ann_id,
                 )
-            else:
-                last_ann = last_or_none(self.annotations)
-                if last_ann is not None:
-                    ann = last_ann[1]
-                    ann.pending_open_context.append((tag, attrs))
+            elif self._last_ann is not None:
+                self._last_ann.pending_open_context.append(entry)
             return
 
         # entering an annotation
@@ -122,27 +105,35 @@ class ReadeckExtractor(HTMLParser):
 
         self._inside_rd = True
         self._current_ann_id = ann_id
-        self._current_ann_color = color
         self._current_ann_text_parts = []
 
         # record in annotations dict (OrderedDict keeps insertion order)
-        if ann_id not in self.annotations:
-            self.annotations[ann_id] = Annotation( # type: ignore
+        ann = self.annotations.get(ann_id)
+        if ann is None:
+            # Only the tags after the innermost <section> are emitted, and the <section> itself
+            # stops closing tags from popping the context further, so nothing before it is needed.
+            if self.section_indices:
+                context = self.stack[self.section_indices[-1]:-1]
+                opened = context[1:]
+            else:
+                context = self.stack[:-1]  # stack without rd-annotation
+                opened = context
+            ann = Annotation(
                 color=color,
-                context=[],
-                text="",
+                context=context,
+                parts=[start_tag for _, start_tag in opened],
                 first_index=self.order_counter,
             )
+            self.annotations[ann_id] = ann
+            self._last_ann = ann
             self.order_counter += 1
-            self.annotations[ann_id].context = self.stack[:-1]  # snapshot of stack without rd-annotation
-            for ctx_tag in ctx_up_to_section(self.annotations[ann_id].context):
-                self.annotations[ann_id].text += open_tag_str(ctx_tag)
         # update color if we didn't have it before
-        if self.annotations[ann_id].color is None and color is not None:
-            self.annotations[ann_id].color = color
-        self.annotations[ann_id].text += ''.join(open_tag_str(s) for s in self.annotations[ann_id].pending_open_context)
-        self.annotations[ann_id].context += self.annotations[ann_id].pending_open_context
-        self.annotations[ann_id].pending_open_context = []
+        if ann.color is None and color is not None:
+            ann.color = color
+        if ann.pending_open_context:
+            ann.parts.extend(start_tag for _, start_tag in ann.pending_open_context)
+            ann.context.extend(ann.pending_open_context)
+            ann.pending_open_context = []
         return
 
     def handle_startendtag(self, tag, attrs):
@@ -151,6 +142,7 @@ class ReadeckExtractor(HTMLParser):
         self.handle_endtag(tag)
 
     def handle_endtag(self, tag):
+        tag = sys.intern(tag)
         # pop from stack
         if self.stack[-1][0] != tag:
             logging.warning(
@@ -160,16 +152,17 @@ class ReadeckExtractor(HTMLParser):
             )
             return
         self.stack.pop()
-        last_ann = last_or_none(self.annotations)
-        if last_ann is not None and not self._inside_rd:
-            ann = last_ann[1]
+        if tag == "section":
+            self.section_indices.pop()
+        ann = self._last_ann
+        if ann is not None and not self._inside_rd:
             if ann.pending_open_context and ann.pending_open_context[-1][0] == tag:
                 # remove from pending and do not add to text
                 ann.pending_open_context.pop()
             if not ann.pending_open_context and ann.context and ann.context[-1][0] == tag and tag != "section":
                 # remove from context and add to text
                 ann.context.pop()
-                ann.text += close_tag_str(tag)
+                ann.parts.append(close_tag_str(tag))
                 return
         # If we are ending an rd-annotation, finalize the occurrence
         if tag == "rd-annotation":
@@ -180,25 +173,12 @@ class ReadeckExtractor(HTMLParser):
                 )
                 # stray end tag; ignore
                 return
-            # capture context: tags after the last <section> in the stack
-            # We want the context "up to the <section> level" -> find last index of tag == 'section' in stack
-            stack_snapshot = self.stack[:]
-            # find last 'section'
-            sec_index = -1
-            for i in range(len(stack_snapshot)-1, -1, -1):
-                if stack_snapshot[i][0] == "section":
-                    sec_index = i
-                    break
-            context = stack_snapshot[sec_index+1 :] if sec_index != -1 else stack_snapshot[:]
-
             # store occurrence
-            text = "".join(self._current_ann_text_parts)
-            self.annotations[self._current_ann_id].text += text # type: ignore
+            self.annotations[self._current_ann_id].parts.extend(self._current_ann_text_parts) # type: ignore
 
             # reset annotation state
             self._inside_rd = False
             self._current_ann_id = None
-            self._current_ann_color = None
             self._current_ann_text_parts = []
 
     def handle_data(self, data):
@@ -225,33 +205,320 @@ class ReadeckExtractor(HTMLParser):
     def error(self, message):
         logging.error("HTMLParser error: %s", message)
 
-@dataclass
+@dataclass(slots=True)
 class ExtractedAnnotation:
     id: str
     color: Optional[str]
     text: str
 
-def extract_readeck_annotations(html_string: str) -> list[ExtractedAnnotation]:
-    """
-    Parse the html_string and return a list of annotation HTML strings (one per annotation id),
-    ordered by first-seen order.
-    """
-    p = ReadeckExtractor()
-    p.feed(html_string)
-    p.close()
+# Before the first <rd-annotation> the extractor only maintains its tag stack, and a balanced
+# <section> without annotations has no effect on the extracted annotations at all. The prescan
+# drops such parts with a cheap regex scan, so the HTMLParser only tokenizes what matters.
+# Whenever the markup is not plain enough to be sure the scan agrees with HTMLParser, it stops
+# filtering and passes the rest through unchanged.
+
+ANNOTATION_MARKER = "rd-annotation"
+ANNOTATION_MARKER_RE = re.compile(ANNOTATION_MARKER, re.IGNORECASE)
+# elements whose content HTMLParser does not tokenize as markup
+RAW_TEXT_TAGS = frozenset({
+    "script", "style", "textarea", "title", "xmp", "iframe", "noembed", "noframes", "noscript", "plaintext",
+})
+MAX_PENDING_TAG_LENGTH = 64 * 1024
+TOKEN_RE = re.compile(
+    r"""(?P<comment><!--.*?-->)
+      | (?P<doctype><!doctype[^>]*>)
+      | </(?P<end>[a-zA-Z][^\t\n\r\f />\x00]*)[^>]*>
+      | <(?P<start>[a-zA-Z][^\t\n\r\f />\x00]*)(?:[^>"']|"[^"]*"|'[^']*')*>
+    """,
+    re.DOTALL | re.IGNORECASE | re.VERBOSE,
+)
+# the subset of TOKEN_RE that HTMLParser is known to tokenize the same way; an unquoted
+# attribute value must not end in "/", HTMLParser reads <img src=a.png/> as src="a.png/"
+PLAIN_TOKEN_RE = re.compile(
+    r"""<(?:(?P<start>[a-zA-Z][-a-zA-Z0-9:]*)
+             (?:\s+[^\s"'<>/=]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'=<>`]++(?<!/)))?)*\s*/?>
+          | /(?P<end>[a-zA-Z][-a-zA-Z0-9:]*)\s*>
+          | !--.*?-->
+          | ![dD][oO][cC][tT][yY][pP][eE][^>]*>)
+    """,
+    re.DOTALL | re.VERBOSE,
+)
+
+class PrefixFilter:
+    """Incrementally drop everything before the first <rd-annotation> except the start tags of
+    the elements that are still open at that point."""
+
+    def __init__(self):
+        self.buffer = ""
+        self.stack: list[tuple[str, str]] = []  # (tag, start tag text) of open elements
+        self.done = False
+
+    def feed(self, text: str, final: bool = False) -> str:
+        """Return the part of `text` that has to be passed on to the parser."""
+        if self.done:
+            return text
+        buf = self.buffer + text
+        pos = 0
+        while (lt := buf.find("<", pos)) != -1:
+            m = PLAIN_TOKEN_RE.match(buf, lt)
+            if m is None:
+                nxt = buf[lt + 1 : lt + 2]
+                if not (nxt.isascii() and nxt.isalpha()) and nxt not in ("/", "!", "?"):
+                    if nxt or final:
+                        pos = lt + 1  # a literal "<" in text
+                        continue
+                elif final or nxt == "?" or (nxt == "!" and not "<!--".startswith(buf[lt : lt + 4])) or TOKEN_RE.match(buf, lt):
+                    return self._stop(buf, lt)
+                if len(buf) - lt > MAX_PENDING_TAG_LENGTH:
+                    return self._stop(buf, lt)
+                pos = lt  # possibly an incomplete tag, wait for more data
+                break
+            if m["start"]:
+                tag = m["start"].lower()
+                if tag == ANNOTATION_MARKER or tag in RAW_TEXT_TAGS:
+                    return self._stop(buf, lt)
+                if not m.group().endswith("/>"):
+                    self.stack.append((tag, m.group()))
+            elif m["end"]:
+                if not self.stack or self.stack[-1][0] != m["end"].lower():
+                    return self._stop(buf, lt)
+                self.stack.pop()
+            pos = m.end()
+        else:
+            pos = len(buf)
+        self.buffer = buf[pos:]
+        return ""
 
+    def _stop(self, buf: str, pos: int) -> str:
+        """Replay the open elements and pass everything from `pos` on through from now on."""
+        self.done = True
+        self.buffer = ""
+        return "".join(start_tag for _, start_tag in self.stack) + buf[pos:]
+
+def balanced_element_end(html_string: str, start: int) -> Optional[int]:
+    """Return the end index of the element starting at `start` if it is balanced, annotation-free
+    and only contains plain markup, else None."""
+    stack = []
+    pos = start
+    while (lt := html_string.find("<", pos)) != -1:
+        m = PLAIN_TOKEN_RE.match(html_string, lt)
+        if m is None:
+            nxt = html_string[lt + 1 : lt + 2]
+            if not nxt or (nxt.isascii() and nxt.isalpha()) or nxt in ("/", "!", "?"):
+                return None
+            pos = lt + 1
+            continue
+        if m["start"]:
+            tag = m["start"].lower()
+            if tag == ANNOTATION_MARKER or tag in RAW_TEXT_TAGS:
+                return None
+            if not m.group().endswith("/>"):
+                stack.append(tag)
+        elif m["end"]:
+            if not stack or stack.pop() != m["end"].lower():
+                return None
+            if not stack:
+                return m.end()
+        else:
+            return None  # comment or doctype
+        pos = m.end()
+    return None
+
+def drop_unannotated_sections(html_string: str) -> str:
+    """Remove balanced <section> elements that contain no annotation."""
+    parts = []
+    keep_from = 0
+    pos = 0
+    while (start := html_string.find("<section", pos)) != -1:
+        pos = start + 1
+        m = PLAIN_TOKEN_RE.match(html_string, start)
+        if m is None or (m["start"] or "").lower() != "section":
+            continue
+        if html_string.rfind("<", 0, start) > html_string.rfind(">", 0, start):
+            continue  # inside a tag or comment
+        if html_string.rfind("<rd-annotation", 0, start) > html_string.rfind("</rd-annotation", 0, start):
+            continue  # inside an annotation
+        end = balanced_element_end(html_string, start)
+        if end is None or "-->" in html_string[start:end]:
+            continue  # "-->" could end a comment the section is part of
+        parts.append(html_string[keep_from:start])
+        keep_from = pos = end
+    parts.append(html_string[keep_from:])
+    return "".join(parts)
+
+def prescan(html_string: str) -> str:
+    """Reduce `html_string` to the parts that can influence the extracted annotations."""
+    if not ANNOTATION_MARKER_RE.search(html_string):
+        return ""
+    prefix_filter = PrefixFilter()
+    return drop_unannotated_sections(prefix_filter.feed(html_string, final=True))
+
+# Fast tokenizer for Readeck's sanitized article HTML. It produces exactly the handler calls
+# HTMLParser would for plain markup (tags, comments, doctype, text and well-formed character
+# references). At the first construct it does not model (raw text elements, processing
+# instructions, CDATA, bogus comments, unterminated references, stray quotes in tags, ...) it
+# hands the rest of the document over to HTMLParser itself. The extractor state does not depend
+# on which tokenizer produced the events, so the result is the same.
+
+# references HTMLParser passes to handle_entityref/handle_charref unchanged
+PLAIN_REF_RE = re.compile(r"&(?:[a-zA-Z][-.a-zA-Z0-9]*|#[0-9]+|#[xX][0-9a-fA-F]+);")
+ATTR_RE = re.compile(r"""([^\s/>=]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s>]*))?""")
+
+def _plain_text(buf: str, start: int, end: int) -> bool:
+    """Whether every "&" in buf[start:end] starts a complete character reference."""
+    amp = buf.find("&", start, end)
+    while amp != -1:
+        m = PLAIN_REF_RE.match(buf, amp, end)
+        if m is None:
+            return False
+        amp = buf.find("&", m.end(), end)
+    return True
+
+def _parse_attrs(start_tag: str, tag_name_end: int) -> list[HtmlAttribute]:
+    attrs: list[HtmlAttribute] = []
+    for m in ATTR_RE.finditer(start_tag, tag_name_end, len(start_tag) - 1):
+        value = m[2]
+        if value is not None:
+            if value[:1] in ("'", '"'):
+                value = value[1:-1]
+            value = html.unescape(value)
+        attrs.append((m[1].lower(), value))
+    return attrs
+
+class ScanningReadeckExtractor(ReadeckExtractor):
+    def __init__(self):
+        super().__init__()
+        self._pending = ""
+        self._starttag_text: Optional[str] = None
+        self._fallback = False
+
+    def get_starttag_text(self):
+        return super().get_starttag_text() if self._fallback else self._starttag_text
+
+    def feed(self, data):
+        if self._fallback:
+            super().feed(data)
+            return
+        buf = self._pending + data
+        text_start = pos = 0
+        while True:
+            lt = buf.find("<", pos)
+            if lt == -1:
+                # keep the text if it may still become part of an annotation or ends in a reference
+                keep = self._inside_rd or buf.find("&", text_start) != -1
+                self._pending = buf[text_start:] if keep else ""
+                return
+            m = PLAIN_TOKEN_RE.match(buf, lt)
+            if m is None:
+                nxt = buf[lt + 1 : lt + 2]
+                if nxt and not (nxt.isascii() and nxt.isalpha()) and nxt not in ("/", "!", "?"):
+                    pos = lt + 1  # a literal "<" in text
+                    continue
+                if TOKEN_RE.match(buf, lt) is None and (
+                    not nxt or (nxt != "?" and ">" not in buf[lt:]) or buf.startswith("<!--", lt) and "-->" not in buf[lt:]
+                ):
+                    # an incomplete token, wait for more data
+                    self._pending = buf[text_start:]
+                    return
+                self._hand_over(buf, text_start)
+                return
+            if not _plain_text(buf, text_start, lt):
+                self._hand_over(buf, text_start)
+                return
+            if tag := m["start"]:
+                tag = tag.lower()
+                if tag in RAW_TEXT_TAGS:
+                    self._hand_over(buf, text_start)
+                    return
+                self._flush_text(buf, text_start, lt)
+                start_tag = m.group()
+                self._starttag_text = start_tag
+                attrs = _parse_attrs(start_tag, m.end("start") - lt) if tag == ANNOTATION_MARKER else []
+                if start_tag.endswith("/>"):
+                    self.handle_startendtag(tag, attrs)
+                else:
+                    self.handle_starttag(tag, attrs)
+            elif tag := m["end"]:
+                self._flush_text(buf, text_start, lt)
+                self.handle_endtag(tag.lower())
+            else:
+                self._flush_text(buf, text_start, lt)  # comments and doctype are ignored
+            text_start = pos = m.end()
+
+    def _flush_text(self, buf: str, start: int, end: int):
+        if self._inside_rd and start < end:
+            self._current_ann_text_parts.append(buf[start:end])
+
+    def _hand_over(self, buf: str, pos: int):
+        """Let HTMLParser tokenize everything from `pos` on."""
+        self._pending = ""
+        self._fallback = True
+        super().feed(buf[pos:])
+
+    def close(self):
+        if not self._fallback and self._pending:
+            self._hand_over(self._pending, 0)
+        if self._fallback:
+            super().close()
+
+EXTRACTOR_BACKENDS: dict[str, type[ReadeckExtractor]] = {
+    "html.parser": ReadeckExtractor,  # reference implementation
+    "scanner": ScanningReadeckExtractor,
+}
+DEFAULT_BACKEND = DEFAULT_PARSER
+
+def new_extractor(backend: str = DEFAULT_BACKEND) -> ReadeckExtractor:
+    try:
+        return EXTRACTOR_BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(f"unknown extraction backend {backend!r}") from None
+
+def _collect_annotations(p: ReadeckExtractor) -> list[ExtractedAnnotation]:
     results = []
-    for ann_id, meta in p.annotations.items():
-        ann = p.annotations[ann_id]
+    for ann_id, ann in p.annotations.items():
         # close any remaining open tags in context
         for tag, _ in reversed(ann.context):
             if tag == "section":
                 break
-            ann.text += close_tag_str(tag)
+            ann.parts.append(close_tag_str(tag))
         results.append(ExtractedAnnotation(
             id=ann_id,
-            color=meta.color,
+            color=ann.color,
             text=ann.text,
         ))
 
     return results
+
+def extract_readeck_annotations(
+    html_string: str, use_prescan: bool = True, backend: str = DEFAULT_BACKEND
+) -> list[ExtractedAnnotation]:
+    """
+    Parse the html_string and return a list of annotation HTML strings (one per annotation id),
+    ordered by first-seen order. `backend` selects the tokenizer, see EXTRACTOR_BACKENDS.
+    """
+    p = new_extractor(backend)
+    if use_prescan:
+        html_string = prescan(html_string)
+        if not html_string:
+            return []
+    p.feed(html_string)
+    p.close()
+    return _collect_annotations(p)
+
+def extract_readeck_annotations_stream(
+    chunks: Iterable[bytes], encoding: str = "utf-8", backend: str = DEFAULT_BACKEND
+) -> list[ExtractedAnnotation]:
+    """
+    Like extract_readeck_annotations, but decode and parse the document chunk by chunk,
+    so the whole document never has to be held in memory at once.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    prefix_filter = PrefixFilter()
+    p = new_extractor(backend)
+    for chunk in chunks:
+        if text := prefix_filter.feed(decoder.decode(chunk)):
+            p.feed(text)
+    if text := prefix_filter.feed(decoder.decode(b"", final=True), final=True):
+        p.feed(text)
+    p.close()
+    return _collect_annotations(p)
@@ -0,0 +1,268 @@
+"""On-disk cache of Readeck API responses, revalidated with ETag/Last-Modified."""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Generator, Iterable, Iterator, Optional
+
+from .constants import CACHE_MAX_BYTES, CHUNK_SIZE, EXTRACTION_CACHE_MAX_AGE, EXTRACTION_CACHE_MAX_BYTES
+
+
+def default_cache_dir() -> Path:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return Path(base) / "readeck-annotation-export"
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    size: int
+    sha256: str
+    path: Path
+
+    def validators(self) -> dict[str, str]:
+        """Request headers that ask the server to answer 304 if the cached body is still current."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+# an entry file is the body, followed by its metadata as JSON and the length of that JSON
+TRAILER = struct.Struct(">Q")
+
+
+def _read_meta(f: BinaryIO) -> Optional[dict]:
+    try:
+        f.seek(-TRAILER.size, os.SEEK_END)
+        (length,) = TRAILER.unpack(f.read(TRAILER.size))
+        f.seek(-TRAILER.size - length, os.SEEK_END)
+        return json.loads(f.read(length))
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+class ResponseCache:
+    """Response bodies keyed by URL, stored as one `<sha256(url)>.entry` file each.
+
+    Each file holds the body together with its validators and digest, so an entry is always
+    replaced as a whole. The least recently used entries are evicted once the total size
+    exceeds `max_bytes`.
+    """
+
+    def __init__(self, directory: Path | str | None = None, max_bytes: int = CACHE_MAX_BYTES):
+        self.directory = Path(directory) if directory is not None else default_cache_dir()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = sum(p.stat().st_size for p in self.directory.glob("*.entry"))
+
+    def _path(self, url: str) -> Path:
+        return self.directory / (hashlib.sha256(url.encode("utf-8")).hexdigest() + ".entry")
+
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        path = self._path(url)
+        try:
+            with open(path, "rb") as f:
+                meta = _read_meta(f)
+        except OSError:
+            return None
+        if meta is None or meta.get("url") != url:
+            return None
+        return CacheEntry(
+            url=url,
+            etag=meta.get("etag"),
+            last_modified=meta.get("last_modified"),
+            size=meta["size"],
+            sha256=meta["sha256"],
+            path=path,
+        )
+
+    def read(self, entry: CacheEntry) -> bytes:
+        """Return the cached body and mark it as recently used."""
+        return b"".join(self.iter_body(entry))
+
+    def iter_body(self, entry: CacheEntry, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Yield the cached body in chunks and mark it as recently used.
+
+        Raises OSError if the entry was replaced since it was looked up, so that the body
+        always matches `entry.sha256`.
+        """
+        try:
+            os.utime(entry.path)
+        except OSError:
+            pass
+        with open(entry.path, "rb") as f:
+            meta = _read_meta(f)
+            if meta is None or meta.get("sha256") != entry.sha256:
+                raise OSError(f"cached response for {entry.url} changed while it was read")
+            f.seek(0)
+            remaining = entry.size
+            while remaining and (chunk := f.read(min(chunk_size, remaining))):
+                remaining -= len(chunk)
+                yield chunk
+
+    def tee(
+        self,
+        url: str,
+        chunks: Iterable[bytes],
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> Generator[bytes, None, None]:
+        """Yield `chunks` unchanged while writing them to the cache.
+
+        The entry only replaces the previous one once all chunks have been consumed; a body that
+        is abandoned halfway is discarded.
+        """
+        path = self._path(url)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                    yield chunk
+                meta = {
+                    "url": url,
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "size": size,
+                    "sha256": digest.hexdigest(),
+                }
+                encoded = json.dumps(meta).encode("utf-8")
+                f.write(encoded)
+                f.write(TRAILER.pack(len(encoded)))
+            with self._lock:
+                old_size = path.stat().st_size if path.exists() else 0
+                os.replace(tmp_name, path)
+                self._total += os.path.getsize(path) - old_size
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        if self._total > self.max_bytes:
+            self.evict()
+
+    def store(
+        self,
+        url: str,
+        chunks: Iterable[bytes],
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> Optional[CacheEntry]:
+        """Write the body given as `chunks` and its validators."""
+        for _ in self.tee(url, chunks, etag=etag, last_modified=last_modified):
+            pass
+        return self.lookup(url)
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits into `max_bytes`."""
+        with self._lock:
+            entries = []
+            for path in self.directory.glob("*.entry"):
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+            self._total = sum(size for _, size, _ in entries)
+            entries.sort()
+            for _, size, path in entries:
+                if self._total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                self._total -= size
+                logging.debug("evicted cached response %s (%d bytes)", path.name, size)
+
+
+class ExtractionCache:
+    """Annotations extracted from article bodies, keyed by the SHA-256 of the body, in SQLite.
+
+    `version` identifies the extractor and conversion settings; entries written with another
+    version are dropped when the cache is opened. Entries not used for `max_age` seconds are
+    dropped as well, and the least recently used ones once the total exceeds `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        path: Path | str,
+        version: str,
+        max_bytes: int = EXTRACTION_CACHE_MAX_BYTES,
+        max_age: float = EXTRACTION_CACHE_MAX_AGE,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.version = version
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "sha256 TEXT PRIMARY KEY, version TEXT NOT NULL, annotations TEXT NOT NULL, "
+                "size INTEGER NOT NULL, accessed REAL NOT NULL)"
+            )
+            deleted = self._db.execute("DELETE FROM results WHERE version != ?", (version,)).rowcount
+            self._db.commit()
+        if deleted:
+            logging.debug("discarded %d extraction results of other versions", deleted)
+        self._total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        self.evict()
+
+    def get(self, sha256: str) -> Optional[list[dict]]:
+        with self._lock:
+            row = self._db.execute("SELECT annotations FROM results WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE results SET accessed = ? WHERE sha256 = ?", (time.time(), sha256))
+            self._db.commit()
+        return json.loads(row[0])
+
+    def put(self, sha256: str, annotations: list[dict]):
+        data = json.dumps(annotations, ensure_ascii=False)
+        with self._lock:
+            old = self._db.execute("SELECT size FROM results WHERE sha256 = ?", (sha256,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (sha256, self.version, data, len(data), time.time()),
+            )
+            self._db.commit()
+            self._total += len(data) - (old[0] if old else 0)
+        if self._total > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Delete expired entries, then least recently used ones until the cache fits into `max_bytes`."""
+        with self._lock:
+            self._db.execute("DELETE FROM results WHERE accessed < ?", (time.time() - self.max_age,))
+            self._total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if self._total > self.max_bytes:
+                rows = self._db.execute("SELECT sha256, size FROM results ORDER BY accessed").fetchall()
+                doomed = []
+                for sha256, size in rows:
+                    if self._total <= self.max_bytes:
+                        break
+                    doomed.append((sha256,))
+                    self._total -= size
+                self._db.executemany("DELETE FROM results WHERE sha256 = ?", doomed)
+                logging.debug("evicted %d extraction results", len(doomed))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
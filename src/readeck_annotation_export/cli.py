@@ -1,18 +1,283 @@
-"""Command-line interface for readeck_annotation_export."""
+"""Command-line interface for readeck_annotation_export.
 
-import logging
+Only argparse and the constants are imported up front, so that usage errors and --help are
+fast; each command imports the modules it needs (core pulls in markdownify) when it runs.
+"""
+
+import argparse
 import sys
 import os
-from .core import generate_articles
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from .constants import (
+    DEFAULT_FORMAT,
+    DEFAULT_JOBS,
+    DEFAULT_PARSER,
+    DEFAULT_RETRIES,
+    DEFAULT_SERVE_PORT,
+    DEFAULT_TIMEOUT,
+    OUTPUT_FORMATS,
+    PARSERS,
+)
+
+
+def add_common_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=DEFAULT_JOBS,
+        help=f"maximum number of concurrent requests (default: {DEFAULT_JOBS}); "
+        "fewer are sent while the server is slow or failing",
+    )
+    parser.add_argument(
+        "--rate", type=float, default=None, metavar="N",
+        help="send at most N requests per second (default: no limit)",
+    )
+    parser.add_argument(
+        "--retries", type=int, default=DEFAULT_RETRIES, metavar="N",
+        help="retry failed requests, 429 and 5xx responses up to N times with backoff (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=DEFAULT_TIMEOUT,
+        help=f"network timeout in seconds (default: {DEFAULT_TIMEOUT:g})",
+    )
+    parser.add_argument(
+        "--cache-dir", default=None,
+        help="directory for cached API responses (default: $XDG_CACHE_HOME/readeck-annotation-export)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="bypass all caches: API responses, converted Markdown and extracted annotations",
+    )
+    parser.add_argument(
+        "--parser", choices=PARSERS, default=DEFAULT_PARSER,
+        help="HTML tokenizer used to extract the annotations (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--processes", type=int, nargs="?", const=0, default=None, metavar="N",
+        help="extract and convert the articles in N worker processes, one per CPU core if N is 0 or "
+        "omitted (default: in the download threads)",
+    )
+    parser.add_argument(
+        "-f", "--format", choices=OUTPUT_FORMATS, default=DEFAULT_FORMAT,
+        help="output format (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true",
+        help="log every request and cache decision",
+    )
+    parser.add_argument(
+        "--stats", choices=("summary", "json"), default=None,
+        help="print timings, sizes and cache hit rates per phase to stderr at the end",
+    )
+    parser.add_argument(
+        "--profile", type=Path, default=None, metavar="FILE",
+        help="profile the run (all threads, but not --processes workers) with cProfile and write the "
+        "statistics to FILE (read them with pstats)",
+    )
+    destination = parser.add_mutually_exclusive_group()
+    destination.add_argument(
+        "-o", "--output", type=Path, default=None,
+        help="write the export to this file instead of stdout",
+    )
+    destination.add_argument(
+        "--update", type=Path, default=None, metavar="FILE",
+        help="update the exported articles in this Logseq page in place, keeping all other blocks",
+    )
+
+
+def check_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+    if args.update is not None and args.format != "logseq":
+        parser.error("--update only works with --format logseq")
+
+
+def setup(args: argparse.Namespace, network: bool = True):
+    import logging
+
+    from .cache import ResponseCache
+    from .core import configure_client, configure_conversion, configure_extraction, configure_processes
+    from .scheduler import FetchScheduler
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO, stream=sys.stderr, format="%(levelname)s: %(message)s"
+    )
+    args.profiler = None
+    if args.profile is not None:
+        from .stats import Profiler
+
+        args.profiler = Profiler()
+        args.profiler.enable()
+    cache = None if args.no_cache else ResponseCache(args.cache_dir)
+    if network:
+        scheduler = FetchScheduler(max_concurrency=args.jobs, rate=args.rate, retries=args.retries)
+        configure_client(timeout=args.timeout, cache=cache, scheduler=scheduler)
+    configure_conversion(None if cache is None else cache.directory / "markdown.sqlite3")
+    configure_extraction(args.parser, None if cache is None else cache.directory / "extraction.sqlite3")
+    configure_processes(args.processes)
+
+
+def write_output(args: argparse.Namespace, articles):
+    """Stream the rendered articles to --output (or stdout) as they become ready."""
+    from .core import new_renderer, write_articles
+    from .update import update_page
+
+    renderer = new_renderer(args.format)
+    if args.update is not None:
+        update_page(args.update, articles, renderer)
+        return
+    if args.output is None:
+        write_articles(sys.stdout, articles, renderer)
+        sys.stdout.write(renderer.footer)
+        return
+    with open(args.output, "w", encoding="utf-8") as out:
+        write_articles(out, articles, renderer)
+        out.write(renderer.footer)
+
+
+@contextmanager
+def running(args: argparse.Namespace, network: bool = True) -> Iterator[None]:
+    """Set up the export for a command and report on it afterwards.
+
+    The shared client, caches and worker processes are released even if the command fails.
+    """
+    from .core import close
+
+    setup(args, network=network)
+    try:
+        yield
+    finally:
+        close()
+    finish(args)
 
 
-def main():
-    if len(sys.argv) < 2:
-        print(f"Usage: {os.path.basename(sys.argv[0])} <article_id> [<article_id> ...]", file=sys.stderr)
+def finish(args: argparse.Namespace):
+    import json
+    import logging
+
+    from . import stats
+
+    if args.profiler is not None:
+        args.profiler.disable()
+        args.profiler.dump_stats(args.profile)
+    if stats.counters:
+        logging.info("run summary: %s", stats.summary())
+    if args.stats == "summary":
+        print(stats.format_report(), file=sys.stderr)
+    elif args.stats == "json":
+        print(json.dumps(stats.report(), sort_keys=True), file=sys.stderr)
+    if stats.counters["failed articles"]:
         sys.exit(1)
-    args = sys.argv[1:]
-    logging.basicConfig(level=logging.DEBUG, stream=sys.stderr, format="%(levelname)s: %(message)s")
-    if not args:
-        raise ValueError("No article IDs provided")
-    articles = generate_articles(args)
-    print(articles)
+
+
+def export_main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(sys.argv[0]),
+        description="Export Readeck annotations as Logseq Markdown. "
+        "Run with `sync` as the first argument to export only bookmarks changed since the last sync, "
+        "with `offline` to export saved article HTML files, or with `serve` to run an HTTP export service.",
+    )
+    parser.add_argument("article_ids", nargs="+", metavar="article_id")
+    add_common_arguments(parser)
+    args = parser.parse_args(argv)
+    check_arguments(parser, args)
+    from .core import iter_articles, skip_failed
+
+    with running(args):
+        write_output(args, skip_failed(iter_articles(args.article_ids, jobs=args.jobs)))
+
+
+def sync_main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} sync",
+        description="Export the annotations of all bookmarks that are new or changed since the last sync.",
+    )
+    parser.add_argument(
+        "--state", type=Path, default=None,
+        help="file recording the last sync (default: $XDG_STATE_HOME/readeck-annotation-export/sync-state.json)",
+    )
+    parser.add_argument(
+        "--full", action="store_true",
+        help="ignore the recorded state and export every bookmark",
+    )
+    add_common_arguments(parser)
+    args = parser.parse_args(argv)
+    check_arguments(parser, args)
+    from .sync import changed_bookmarks, default_state_path, export_changes, load_state, save_state
+
+    args.state = args.state or default_state_path()
+    with running(args):
+        state = load_state(args.state)
+        changed = changed_bookmarks(state, full=args.full)
+        write_output(args, export_changes(state, changed, jobs=args.jobs))
+        save_state(args.state, state)
+
+
+def offline_main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} offline",
+        description="Export the annotations in saved article HTML files without contacting Readeck. "
+        "The bookmark of each article is read from the .json file of the same name, if there is one.",
+    )
+    parser.add_argument(
+        "sources", nargs="+", metavar="source",
+        help="directory, glob pattern, tarball or HTML file of articles",
+    )
+    add_common_arguments(parser)
+    # extraction is the bottleneck without any downloads
+    parser.set_defaults(processes=0)
+    args = parser.parse_args(argv)
+    check_arguments(parser, args)
+    from .core import process_count, skip_failed
+    from .offline import iter_local_articles
+
+    with running(args, network=False):
+        # nothing is downloaded, so keep every worker process busy instead of --jobs requests
+        jobs = process_count() or args.jobs
+        articles = skip_failed(iter_local_articles(args.sources, jobs=jobs))
+        write_output(args, (article for article in articles if article["annotations"]))
+
+
+def serve_main(argv: list[str]):
+    parser = argparse.ArgumentParser(
+        prog=f"{os.path.basename(sys.argv[0])} serve",
+        description="Serve exports over HTTP: GET /export?ids=ID,ID...&format=FORMAT returns the export "
+        "of the given bookmarks. Connections, caches and the converter stay warm between requests.",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: %(default)s)")
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_SERVE_PORT, help="port to listen on (default: %(default)s)"
+    )
+    add_common_arguments(parser)
+    args = parser.parse_args(argv)
+    check_arguments(parser, args)
+    if args.output is not None or args.update is not None:
+        parser.error("--output and --update do not apply to serve")
+    import logging
+
+    from .serve import ExportServer, ExportService
+
+    with running(args):
+        service = ExportService(jobs=args.jobs)
+        server = ExportServer((args.host, args.port), service, default_format=args.format)
+        logging.info("serving exports on http://%s:%d/export", *server.server_address[:2])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            service.close()
+
+
+def main(argv: list[str] | None = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["sync"]:
+        sync_main(argv[1:])
+    elif argv[:1] == ["offline"]:
+        offline_main(argv[1:])
+    elif argv[:1] == ["serve"]:
+        serve_main(argv[1:])
+    else:
+        export_main(argv)
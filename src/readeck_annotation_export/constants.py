@@ -1,2 +1,24 @@
 READECK_URL_FALLBACK = "http://localhost:8000"
 USE_HTML_EXTRACTION = True
+DEFAULT_JOBS = 8
+DEFAULT_TIMEOUT = 30.0  # seconds
+MAX_REDIRECTS = 10  # redirects followed per request, as many as urllib follows
+CHUNK_SIZE = 64 * 1024
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+SYNC_PAGE_SIZE = 100
+MARKDOWN_MEMO_ENTRIES = 4096
+MARKDOWN_STORE_MAX_BYTES = 32 * 1024 * 1024
+MARKDOWN_STORE_MAX_AGE = 90 * 24 * 60 * 60  # seconds
+EXTRACTION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+EXTRACTION_CACHE_MAX_AGE = 90 * 24 * 60 * 60  # seconds
+DEFAULT_RETRIES = 4
+RETRY_BACKOFF = 0.5  # seconds, doubled with every retry
+RETRY_MAX_BACKOFF = 30.0  # seconds
+RETRY_AFTER_MAX = 300.0  # longest Retry-After (seconds) that is waited for
+DEFAULT_SERVE_PORT = 8765
+SERVE_MEMO_ENTRIES = 10000  # articles whose annotations `serve` keeps in memory
+# names known to the CLI before the modules implementing them are imported
+PARSERS = ("html.parser", "scanner")  # see annotation_extractor.EXTRACTOR_BACKENDS
+DEFAULT_PARSER = "scanner"
+OUTPUT_FORMATS = ("logseq", "markdown", "jsonl")  # see render.RENDERERS
+DEFAULT_FORMAT = "logseq"
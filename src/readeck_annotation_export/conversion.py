@@ -0,0 +1,152 @@
+"""Conversion of annotation HTML to Markdown, memoized by a hash of the HTML."""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import cached_property
+from importlib.metadata import version
+from pathlib import Path
+from typing import Optional
+
+from . import stats
+from .constants import MARKDOWN_MEMO_ENTRIES, MARKDOWN_STORE_MAX_AGE, MARKDOWN_STORE_MAX_BYTES
+
+CONVERTER_OPTIONS = {"heading_style": "ATX", "bullets": "*"}
+
+
+class MarkdownConversion:
+    """One configured MarkdownConverter plus a bounded in-memory LRU of its results.
+
+    With a `store_path`, results are also kept in an SQLite database, so the same highlight is
+    only converted once across runs. Keys include the markdownify version and the converter
+    options, so changing either never returns stale Markdown; rows written with another
+    `fingerprint` are dropped when the store is opened. Like ExtractionCache, the store forgets
+    rows not used for `max_age` seconds and the least recently used ones beyond `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = MARKDOWN_MEMO_ENTRIES,
+        store_path: Path | str | None = None,
+        max_bytes: int = MARKDOWN_STORE_MAX_BYTES,
+        max_age: float = MARKDOWN_STORE_MAX_AGE,
+    ):
+        self.max_entries = max_entries
+        self.store_path = store_path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # changes whenever the conversion could produce different Markdown
+        self.fingerprint = json.dumps([version("markdownify"), CONVERTER_OPTIONS], sort_keys=True)
+        self._salt = self.fingerprint.encode("utf-8")
+        self._memo: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._total = 0
+        if store_path is not None:
+            Path(store_path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(store_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS markdown ("
+                "key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, markdown TEXT NOT NULL, "
+                "size INTEGER NOT NULL, accessed REAL NOT NULL)"
+            )
+            deleted = self._db.execute("DELETE FROM markdown WHERE fingerprint != ?", (self.fingerprint,)).rowcount
+            self._db.commit()
+            if deleted:
+                logging.debug("discarded %d Markdown conversions of other converter versions", deleted)
+            self.evict()
+
+    @cached_property
+    def converter(self):
+        # markdownify (and BeautifulSoup) are only imported once something has to be converted
+        from markdownify import MarkdownConverter
+
+        return MarkdownConverter(**CONVERTER_OPTIONS)
+
+    def key(self, html: str) -> str:
+        return hashlib.sha256(self._salt + html.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, markdown: str):
+        self._memo[key] = markdown
+        self._memo.move_to_end(key)
+        while len(self._memo) > self.max_entries:
+            self._memo.popitem(last=False)
+
+    def convert(self, html: str) -> str:
+        return self.convert_batch([html])[0]
+
+    def convert_batch(self, htmls: list[str]) -> list[str]:
+        """Convert all annotations of one article, looking up the memo and the store only once."""
+        keys = [self.key(html) for html in htmls]
+        results: dict[str, str] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memo:
+                    self._memo.move_to_end(key)
+                    results[key] = self._memo[key]
+            missing = [key for key in dict.fromkeys(keys) if key not in results]
+            if missing and self._db is not None:
+                placeholders = ",".join("?" * len(missing))
+                rows = self._db.execute(
+                    f"SELECT key, markdown FROM markdown WHERE key IN ({placeholders})", missing
+                ).fetchall()
+                for key, markdown in rows:
+                    results[key] = markdown
+                    self._remember(key, markdown)
+                if rows:
+                    self._db.executemany(
+                        "UPDATE markdown SET accessed = ? WHERE key = ?", [(time.time(), key) for key, _ in rows]
+                    )
+                    self._db.commit()
+        if hits := sum(key in results for key in keys):
+            stats.count("markdown cache hits", hits)
+        converted = {}
+        for key, html in zip(keys, htmls):
+            if key not in results and key not in converted:
+                converted[key] = self.converter.convert(html).strip()
+        if converted:
+            stats.count("markdown cache misses", len(converted))
+            with self._lock:
+                for key, markdown in converted.items():
+                    self._remember(key, markdown)
+                if self._db is not None:
+                    now = time.time()
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO markdown VALUES (?, ?, ?, ?, ?)",
+                        [(key, self.fingerprint, md, len(md), now) for key, md in converted.items()],
+                    )
+                    self._db.commit()
+                    self._total += sum(len(md) for md in converted.values())
+            if self._total > self.max_bytes:
+                self.evict()
+            results |= converted
+        return [results[key] for key in keys]
+
+    def evict(self):
+        """Delete expired rows, then least recently used ones until the store fits into `max_bytes`."""
+        with self._lock:
+            if self._db is None:
+                return
+            self._db.execute("DELETE FROM markdown WHERE accessed < ?", (time.time() - self.max_age,))
+            self._total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM markdown").fetchone()[0]
+            if self._total > self.max_bytes:
+                rows = self._db.execute("SELECT key, size FROM markdown ORDER BY accessed").fetchall()
+                doomed = []
+                for key, size in rows:
+                    if self._total <= self.max_bytes:
+                        break
+                    doomed.append((key,))
+                    self._total -= size
+                self._db.executemany("DELETE FROM markdown WHERE key = ?", doomed)
+                logging.debug("evicted %d Markdown conversions", len(doomed))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -1,23 +1,34 @@
+import hashlib
 import logging
+import mmap
 import os
-import sys
-import urllib.request
+import threading
+import time
 import json
-from datetime import datetime
-from markdownify import markdownify
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, TextIO
 
-from readeck_annotation_export.annotation_extractor import extract_readeck_annotations
-from readeck_annotation_export.constants import READECK_URL_FALLBACK, USE_HTML_EXTRACTION
-
-def format_date(iso_date: str) -> str:
-    iso_date = iso_date.split("T")[0]
-    date = datetime.strptime(iso_date, "%Y-%m-%d")
-    day = date.day
-    suffix = (
-        "th" if 11 <= day <= 13 else {1: "st", 2: "nd", 3: "rd"}.get(day % 10, "th")
-    )
-    return "[[" + date.strftime(f"%b {day}{suffix}, %Y") + "]]"
+from .annotation_extractor import (
+    DEFAULT_BACKEND,
+    EXTRACTOR_VERSION,
+    ExtractedAnnotation,
+    extract_readeck_annotations,
+    extract_readeck_annotations_stream,
+    new_extractor,
+)
+from .constants import DEFAULT_FORMAT, DEFAULT_JOBS, DEFAULT_TIMEOUT, READECK_URL_FALLBACK, USE_HTML_EXTRACTION
+from .cache import ExtractionCache, ResponseCache
+from .conversion import MarkdownConversion
+from .http_client import Body, ReadeckClient
+from .scheduler import FetchScheduler
+from .render import RENDERERS, Renderer
+from . import stats
 
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
 
 def slash_join(s1: str, s2: str) -> str:
     return s1.rstrip("/") + "/" + s2.lstrip("/")
@@ -31,48 +42,19 @@ def readeck_url(*parts) -> str:
     return result
 
 
+def new_renderer(output_format: str = DEFAULT_FORMAT) -> Renderer:
+    """Create the renderer for `output_format` (see RENDERERS) once per run."""
+    try:
+        renderer_class = RENDERERS[output_format]
+    except KeyError:
+        raise ValueError(f"unknown output format {output_format!r}") from None
+    return renderer_class(readeck_url("bookmarks"))
+
+
 def generate_article(**article):
-    properties = [
-        "collapsed:: true",
-        "type:: [[Article]]",
-        f'url:: {article["url"]}',
-        f'{article["authors"] and
-            "author:: " + ", ".join(
-                [f"[[{author}]]" for author in article["authors"]]
-            ) or ""}',
-        f'{f"links:: [[Readeck]]" +
-            "".join([f", [[{label}]]" for label in article["labels"]]) +
-            (article["site_name"] and f", [[{article["site_name"]}]]")}',
-        f'{article.get("published", "") and "date-published:: " + format_date(article["published"])}',
-    ]
-    annotations_rendered = ""
-    for annotation in article.get("annotations", []):
-        lines = annotation["text"].split("\n")
-        color = annotation["color"] and f'background-color:: {annotation["color"]}'
-        if '```' not in annotation["text"]:
-            annotations_rendered += (
-                f"\t\t- {color}\n\t\t  > " + "\n\t\t  > ".join(lines) + "\n"
-            )
-        else:
-            # Fix code block rendering. Logseq doesn't support indented code blocks in blockquotes.
-            # Use the following syntax instead:
-            # #+BEGIN_QUOTE
-            # ```
-            # code...
-            # ```
-            # #+END_QUOTE
-            annotations_rendered += (
-                f"\t\t- {color}\n\t\t  #+BEGIN_QUOTE\n"
-                + "\n".join("\t\t  " + line for line in lines)
-                + "\n\t\t  #+END_QUOTE\n"
-            )
-    return (
-        f'\t- [{article["title"]}]({
-            readeck_url('bookmarks', article["id"])
-        })\n'
-        + "".join("\t  " + prop + "\n" for prop in properties if prop)
-        + annotations_rendered
-    )
+    buffer = StringIO()
+    new_renderer().write_article(buffer, article)
+    return buffer.getvalue()
 
 
 def readeck_headers() -> dict[str, str]:
@@ -84,53 +66,334 @@ def readeck_headers() -> dict[str, str]:
     }
     return headers
 
+_client: ReadeckClient | None = None
+_client_lock = threading.Lock()
+
+
+def configure_client(
+    timeout: float = DEFAULT_TIMEOUT, cache: ResponseCache | None = None, scheduler: FetchScheduler | None = None
+) -> ReadeckClient:
+    """(Re)create the shared client used by readeck_get/readeck_get_raw.
+
+    Without a `scheduler`, requests are retried and their concurrency adapted with the defaults.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = ReadeckClient(
+            readeck_url(), readeck_headers(), timeout=timeout, cache=cache, scheduler=scheduler or FetchScheduler()
+        )
+        return _client
+
+
+_extraction_backend = DEFAULT_BACKEND
+_extraction_cache: ExtractionCache | None = None
+
+
+def configure_extraction(backend: str = DEFAULT_BACKEND, cache_path: Path | str | None = None):
+    """Select the tokenizer used to extract annotations from article HTML, see EXTRACTOR_BACKENDS.
+
+    With a `cache_path`, the annotations of each article body are cached by its SHA-256. Configure
+    the Markdown conversion first: the cached results are only valid for its settings.
+    """
+    global _extraction_backend, _extraction_cache
+    new_extractor(backend)  # reject unknown names right away
+    _extraction_backend = backend
+    if _extraction_cache is not None:
+        _extraction_cache.close()
+        _extraction_cache = None
+    if cache_path is not None:
+        version = json.dumps([EXTRACTOR_VERSION, markdown_conversion().fingerprint])
+        _extraction_cache = ExtractionCache(cache_path, version=version)
+
+
+def readeck_client() -> ReadeckClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ReadeckClient(readeck_url(), readeck_headers(), scheduler=FetchScheduler())
+        return _client
+
+
 def readeck_get(url):
-    headers=readeck_headers()
-    logging.debug("requesting: %s", readeck_url(url))
-    req = urllib.request.Request(readeck_url(url), headers=headers)
-    with urllib.request.urlopen(req) as response:
-        data = json.loads(response.read())
-        return data
+    return json.loads(readeck_client().get(url))
 
 
 def readeck_get_raw(url: str) -> str:
-    headers=readeck_headers()
-    logging.debug("requesting: %s", readeck_url(url))
-    req = urllib.request.Request(readeck_url(url), headers=headers)
-    with urllib.request.urlopen(req) as response:
-        data = response.read().decode("utf-8")
-        return data
+    return readeck_client().get(url).decode("utf-8")
 
 
 def get_bookmark(id):
     return readeck_get(f"/api/bookmarks/{id}")
 
 
+_conversion: MarkdownConversion | None = None
+_conversion_lock = threading.Lock()
+
+
+def configure_conversion(store_path: Path | str | None = None) -> MarkdownConversion:
+    """(Re)create the shared Markdown conversion stage, optionally backed by a persistent store."""
+    global _conversion
+    with _conversion_lock:
+        if _conversion is not None:
+            _conversion.close()
+        _conversion = MarkdownConversion(store_path=store_path)
+        return _conversion
+
+
+def markdown_conversion() -> MarkdownConversion:
+    global _conversion
+    with _conversion_lock:
+        if _conversion is None:
+            _conversion = MarkdownConversion()
+        return _conversion
+
+
 def to_markdown(html: str) -> str:
-    return markdownify(html, heading_style="ATX", bullets='*').strip()
+    return markdown_conversion().convert(html)
+
+
+_process_pool: "ProcessPoolExecutor | None" = None  # multiprocessing is only imported when needed
+_process_count = 0
+
+
+def _init_worker(backend: str, store_path: Path | str | None):
+    global _conversion, _extraction_cache
+    # the parent owns the result cache
+    _conversion = MarkdownConversion(store_path=store_path)
+    _extraction_cache = None
+    configure_extraction(backend)
+
+
+def configure_processes(processes: int | None = None):
+    """Extract and convert article bodies in `processes` worker processes.
+
+    0 starts one process per CPU core; with None, bodies are handled in the fetching threads.
+    Uses the extraction backend and Markdown store configured at the time of the call. The
+    workers are started lazily from a download thread, so they are never forked: a forked child
+    could inherit a lock held by another thread.
+    """
+    global _process_pool, _process_count
+    if _process_pool is not None:
+        _process_pool.shutdown()
+        _process_pool = None
+        _process_count = 0
+    if processes is not None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        store_path = markdown_conversion().store_path
+        _process_count = processes or os.cpu_count() or 1
+        _process_pool = ProcessPoolExecutor(
+            max_workers=_process_count,
+            mp_context=multiprocessing.get_context(method),
+            initializer=_init_worker,
+            initargs=(_extraction_backend, store_path),
+        )
+
+
+def process_count() -> int:
+    """The number of worker processes set up by configure_processes, 0 if there are none."""
+    return _process_count
+
+
+def close():
+    """Shut down the worker processes and close the shared client, extraction cache and Markdown store."""
+    global _client, _extraction_cache, _conversion
+    configure_processes(None)
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+    if _extraction_cache is not None:
+        _extraction_cache.close()
+        _extraction_cache = None
+    with _conversion_lock:
+        if _conversion is not None:
+            _conversion.close()
+            _conversion = None
+
+
+def convert_annotations(html_annotations: list[ExtractedAnnotation]) -> list[tuple[str, str | None]]:
+    with stats.timer("convert"):
+        texts = markdown_conversion().convert_batch([ann.text for ann in html_annotations])
+    return [(text, ann.color) for text, ann in zip(texts, html_annotations)]
+
+
+def parse_article(body: bytes | mmap.mmap) -> list[tuple[str, str | None]]:
+    """Return (markdown, color) for each annotation in a downloaded (or memory-mapped) article."""
+    with stats.timer("parse"):
+        html_annotations = extract_readeck_annotations(str(body, "utf-8"), backend=_extraction_backend)
+    return convert_annotations(html_annotations)
+
+
+def _parse_in_worker(body: bytes | mmap.mmap) -> tuple[list[tuple[str, str | None]], dict]:
+    """parse_article for the worker processes; also returns the statistics collected meanwhile."""
+    stats.reset()
+    parsed = parse_article(body)
+    return parsed, stats.snapshot()
+
+
+def _parse_file_in_worker(path: str) -> tuple[list[tuple[str, str | None]], dict]:
+    """_parse_in_worker for an article file, so that only its path crosses the process boundary."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as body:
+        return _parse_in_worker(body)
+
+
+def cached_annotations(sha256: str) -> list[dict] | None:
+    if _extraction_cache is None:
+        return None
+    if (annotations := _extraction_cache.get(sha256)) is None:
+        stats.count("extraction cache misses")
+        return None
+    stats.count("extraction cache hits")
+    return annotations
 
 
 def get_annotations(id):
+    # the annotation list is tiny compared to the article, so use it to skip unannotated articles
+    annotations = readeck_get(f"/api/bookmarks/{id}/annotations")
     if not USE_HTML_EXTRACTION:
-        return readeck_get(f"/api/bookmarks/{id}/annotations")
-    data = readeck_get_raw(f"/api/bookmarks/{id}/article")
-    html_annotations = extract_readeck_annotations(data)
-    return [
-        {"text": to_markdown(ann.text), "color": ann.color}
-        for ann in html_annotations
-    ]
-
-
-def generate_articles(article_ids):
-    articles = [get_bookmark(article_id) for article_id in article_ids]
-    annotations = [get_annotations(article_id) for article_id in article_ids]
-    articles_extended = [
-        article | {"annotations": annotation}
-        for article, annotation in zip(articles, annotations)
-    ]
-    heading = "- ## 🔖 Articles"
-    return (
-        heading
-        + "\n"
-        + "".join(generate_article(**article) for article in articles_extended)
-    )
+        return annotations
+    if not annotations:
+        stats.count("article downloads skipped")
+        return []
+    stats.count("article downloads")
+    with readeck_client().stream(f"/api/bookmarks/{id}/article") as body:
+        if body.sha256 is not None and (cached := cached_annotations(body.sha256)) is not None:
+            return cached
+        if _process_pool is None:
+            return stream_annotations(body)
+        # the workers need the whole body
+        data = b"".join(body)
+    # a known digest was looked up above already
+    return annotations_from_body(data, body.sha256, lookup=body.sha256 is None)
+
+
+def stream_annotations(body: Body) -> list[dict]:
+    """Extract and convert the annotations of an article body while it is being downloaded.
+
+    The body's SHA-256 is computed on the way, so the result can still be cached (and a cached
+    result found before the annotations are converted) without holding the whole body in memory.
+    """
+    digest = hashlib.sha256()
+
+    def chunks() -> Iterator[bytes]:
+        for chunk in body:
+            digest.update(chunk)
+            yield chunk
+
+    start = time.perf_counter()
+    html_annotations = extract_readeck_annotations_stream(chunks(), backend=_extraction_backend)
+    # the time spent waiting for the network is accounted for as fetch time
+    stats.add_time("parse", time.perf_counter() - start - body.elapsed)
+    sha256 = body.sha256 or digest.hexdigest()
+    if body.sha256 is None and (cached := cached_annotations(sha256)) is not None:
+        return cached
+    stats.observe("annotations per article", len(html_annotations))
+    parsed = convert_annotations(html_annotations)
+    annotations = [{"text": text, "color": color} for text, color in parsed]
+    if _extraction_cache is not None:
+        _extraction_cache.put(sha256, annotations)
+    return annotations
+
+
+def annotations_from_body(
+    body: bytes | mmap.mmap, sha256: str | None = None, path: Path | str | None = None, lookup: bool = True
+) -> list[dict]:
+    """Extract and convert the annotations of a whole article body.
+
+    Results are looked up in (and added to) the extraction cache by the body's SHA-256, and
+    the work is done in the worker processes if there are any. With a `path` to the file the
+    body was mapped from, the workers read the file themselves.
+    """
+    sha256 = sha256 or hashlib.sha256(body).hexdigest()
+    if lookup and (cached := cached_annotations(sha256)) is not None:
+        return cached
+    if _process_pool is not None:
+        # only the raw body (or its path) and the small results cross the process boundary
+        if path is not None:
+            future = _process_pool.submit(_parse_file_in_worker, str(path))
+        else:
+            future = _process_pool.submit(_parse_in_worker, bytes(body))
+        parsed, worker_stats = future.result()
+        stats.merge(worker_stats)
+    else:
+        parsed = parse_article(body)
+    stats.observe("annotations per article", len(parsed))
+    annotations = [{"text": text, "color": color} for text, color in parsed]
+    if _extraction_cache is not None:
+        _extraction_cache.put(sha256, annotations)
+    return annotations
+
+
+def iter_articles(article_ids: Iterable[str], jobs: int = DEFAULT_JOBS, window: int | None = None) -> Iterator[tuple]:
+    """Fetch bookmarks and annotations with at most `jobs` requests in flight.
+
+    Yields (article_id, article, error) tuples in the same order as `article_ids` as soon as each
+    article is complete. Exactly one of `article` and `error` is None, so a failing article does
+    not abort the batch. At most `window` (default: 2 * jobs) articles are held in memory.
+    """
+    jobs = max(1, jobs)
+    window = max(1, window or 2 * jobs)
+    ids = iter(article_ids)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        in_flight = deque()
+
+        def submit_next() -> bool:
+            for article_id in ids:
+                in_flight.append(
+                    (article_id, executor.submit(get_bookmark, article_id), executor.submit(get_annotations, article_id))
+                )
+                return True
+            return False
+
+        while len(in_flight) < window and submit_next():
+            pass
+        while in_flight:
+            article_id, bookmark, annotations = in_flight.popleft()
+            submit_next()
+            try:
+                article = bookmark.result() | {"annotations": annotations.result()}
+            except Exception as e:
+                logging.error("failed to export article %s: %s", article_id, e)
+                stats.count("failed articles")
+                yield article_id, None, e
+            else:
+                yield article_id, article, None
+
+
+def fetch_articles(article_ids, jobs=DEFAULT_JOBS):
+    """Like iter_articles, but return all results as a list."""
+    return list(iter_articles(article_ids, jobs=jobs))
+
+
+def skip_failed(results: Iterable[tuple]) -> Iterator[dict]:
+    """Yield the articles of successful results and log a summary of the failed ones at the end."""
+    failed = []
+    total = 0
+    for article_id, article, error in results:
+        total += 1
+        if error is None:
+            yield article
+        else:
+            failed.append(article_id)
+    if failed:
+        logging.error("%d of %d articles failed: %s", len(failed), total, ", ".join(failed))
+
+
+def write_articles(out: TextIO, articles: Iterable[dict], renderer: Renderer | None = None):
+    """Write the articles to `out` (as a Logseq Articles block by default) as they arrive."""
+    (renderer or new_renderer()).write(out, articles)
+
+
+def render_articles(articles) -> str:
+    buffer = StringIO()
+    write_articles(buffer, articles)
+    return buffer.getvalue()
+
+
+def generate_articles(article_ids, jobs=DEFAULT_JOBS):
+    return render_articles(skip_failed(iter_articles(article_ids, jobs=jobs)))
@@ -0,0 +1,332 @@
+"""Keep-alive HTTP client shared by all requests to the Readeck API."""
+
+import base64
+import http.client
+import logging
+import re
+import ssl
+import threading
+import time
+import urllib.parse
+import urllib.request
+import zlib
+from contextlib import contextmanager
+from typing import Generator, Iterator, Optional
+
+from . import stats
+from .cache import ResponseCache
+from .constants import CHUNK_SIZE, DEFAULT_TIMEOUT, MAX_REDIRECTS
+from .scheduler import RETRY_STATUSES, FetchScheduler, parse_retry_after
+
+# errors that mean a reused keep-alive connection was closed by the server in the meantime
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+BOOKMARK_ID_RE = re.compile(r"(/api/bookmarks/)[^/]+")
+REDIRECT_STATUSES = frozenset({301, 302, 303, 307, 308})
+
+
+def endpoint(path: str) -> str:
+    """The path without query and bookmark ID, for statistics per endpoint."""
+    return BOOKMARK_ID_RE.sub(r"\1{id}", path.split("?", 1)[0])
+
+
+def proxy_for(url: str) -> Optional[urllib.parse.SplitResult]:
+    """The proxy urllib would use for `url` according to the environment (`https_proxy`, ...), if any."""
+    parts = urllib.parse.urlsplit(url)
+    proxy = urllib.request.getproxies().get(parts.scheme)
+    if not proxy or urllib.request.proxy_bypass(parts.hostname or ""):
+        return None
+    if "://" not in proxy:
+        proxy = "http://" + proxy
+    proxy_parts = urllib.parse.urlsplit(proxy)
+    if proxy_parts.scheme != "http":
+        raise ValueError(f"unsupported proxy {proxy!r} for {url}: only http:// proxies are supported")
+    return proxy_parts
+
+
+def proxy_headers(proxy: urllib.parse.SplitResult) -> dict[str, str]:
+    if proxy.username is None:
+        return {}
+    credentials = urllib.parse.unquote(proxy.username) + ":" + urllib.parse.unquote(proxy.password or "")
+    return {"Proxy-Authorization": "Basic " + base64.b64encode(credentials.encode("utf-8")).decode("ascii")}
+
+
+class HTTPError(Exception):
+    def __init__(self, url: str, status: int, reason: str):
+        super().__init__(f"HTTP {status} {reason} for {url}")
+        self.url = url
+        self.status = status
+        self.reason = reason
+
+
+def iter_decoded(response: http.client.HTTPResponse, chunk_size: int = CHUNK_SIZE) -> Generator[bytes, None, None]:
+    """Yield the body of `response` in chunks, transparently decoding gzip."""
+    decoder = None
+    if response.getheader("Content-Encoding", "").lower() == "gzip":
+        decoder = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    while chunk := response.read(chunk_size):
+        if decoder is not None:
+            chunk = decoder.decompress(chunk)
+        if chunk:
+            yield chunk
+    if decoder is not None and (tail := decoder.flush()):
+        yield tail
+
+
+class Body:
+    """Iterable over the decoded chunks of a response body.
+
+    `sha256` is the digest of the body if it is known before reading it, i.e. for cached bodies.
+    """
+
+    def __init__(self, chunks: Iterator[bytes], sha256: Optional[str] = None):
+        self.chunks = chunks
+        self.sha256 = sha256
+        self.size = 0
+        self.elapsed = 0.0  # seconds spent waiting for chunks, i.e. not processing them
+
+    def __iter__(self) -> Iterator[bytes]:
+        clock = time.perf_counter
+        while True:
+            start = clock()
+            chunk = next(self.chunks, None)
+            self.elapsed += clock() - start
+            if chunk is None:
+                return
+            self.size += len(chunk)
+            yield chunk
+
+
+class ReadeckClient:
+    """Issue GET requests against one Readeck instance, reusing one connection per thread.
+
+    Redirects are followed (up to MAX_REDIRECTS), and the proxies configured in the environment
+    are used like urllib does.
+    With a `cache`, responses carrying an ETag or Last-Modified header are stored on disk and
+    later requests for the same URL are revalidated, so unchanged bodies are not downloaded again.
+    With a `scheduler`, requests are rate limited and failed ones are retried, see FetchScheduler.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        headers: dict[str, str],
+        timeout: float = DEFAULT_TIMEOUT,
+        cache: Optional[ResponseCache] = None,
+        scheduler: Optional[FetchScheduler] = None,
+    ):
+        parts = urllib.parse.urlsplit(base_url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"unsupported URL scheme in {base_url!r}")
+        self.origin = (parts.scheme, parts.hostname or "localhost", parts.port)
+        self.base_url = base_url.rstrip("/")
+        self.headers = headers | {"Accept-Encoding": "gzip", "Connection": "keep-alive"}
+        self.timeout = timeout
+        self.cache = cache
+        self.scheduler = scheduler
+        self._local = threading.local()
+        self._connections: list[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        self._proxies: dict[tuple[str, str], Optional[urllib.parse.SplitResult]] = {}
+
+    def _proxy(self, scheme: str, host: str) -> Optional[urllib.parse.SplitResult]:
+        """The proxy for an origin; the environment is only read once per origin."""
+        if (scheme, host) not in self._proxies:
+            self._proxies[scheme, host] = proxy_for(f"{scheme}://{host}")
+        return self._proxies[scheme, host]
+
+    def _new_connection(self, scheme: str, host: str, port: Optional[int]) -> http.client.HTTPConnection:
+        proxy = self._proxy(scheme, host)
+        if proxy is None:
+            if scheme == "https":
+                return http.client.HTTPSConnection(host, port, timeout=self.timeout, context=ssl.create_default_context())
+            return http.client.HTTPConnection(host, port, timeout=self.timeout)
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                proxy.hostname, proxy.port or 80, timeout=self.timeout, context=ssl.create_default_context()
+            )
+            conn.set_tunnel(host, port, headers=proxy_headers(proxy))
+            return conn
+        return http.client.HTTPConnection(proxy.hostname, proxy.port or 80, timeout=self.timeout)
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._new_connection(*self.origin)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+            with self._lock:
+                if conn in self._connections:
+                    self._connections.remove(conn)
+
+    def url(self, path: str) -> str:
+        return self.base_url + "/" + path.lstrip("/")
+
+    def _send_once(self, url: str, headers: dict[str, str]) -> http.client.HTTPResponse:
+        """GET `url` on this thread's keep-alive connection, or on a new one for other origins."""
+        parts = urllib.parse.urlsplit(url)
+        origin = (parts.scheme, parts.hostname or "localhost", parts.port)
+        target = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+        if parts.scheme == "http" and (proxy := self._proxy(parts.scheme, origin[1])) is not None:
+            # plain HTTP requests are sent to the proxy with the absolute URL as target
+            target = url
+            headers = headers | proxy_headers(proxy)
+        logging.debug("requesting: %s", url)
+        if origin != self.origin:
+            conn = self._new_connection(*origin)
+            try:
+                conn.request("GET", target, headers=headers)
+                return conn.getresponse()
+            finally:
+                conn.close()  # the response can still be read
+        reused = getattr(self._local, "conn", None) is not None
+        conn = self._connection()
+        try:
+            conn.request("GET", target, headers=headers)
+            return conn.getresponse()
+        except STALE_CONNECTION_ERRORS:
+            self._drop_connection()
+            if not reused:
+                raise
+        except Exception:
+            self._drop_connection()
+            raise
+        # the server closed an idle keep-alive connection; GET is idempotent, so retry once
+        conn = self._connection()
+        conn.request("GET", target, headers=headers)
+        return conn.getresponse()
+
+    def _send(self, path: str, extra_headers: Optional[dict[str, str]] = None) -> http.client.HTTPResponse:
+        """GET `path`, following redirects like urllib."""
+        url = self.url(path)
+        headers = self.headers | extra_headers if extra_headers else self.headers
+        for _ in range(MAX_REDIRECTS):
+            response = self._send_once(url, headers)
+            location = response.getheader("Location")
+            if response.status not in REDIRECT_STATUSES or not location:
+                return response
+            response.read()
+            if response.will_close:
+                self._drop_connection()
+            new_url = urllib.parse.urljoin(url, location)
+            new_parts = urllib.parse.urlsplit(new_url)
+            if new_parts.scheme not in ("http", "https"):
+                raise HTTPError(url, response.status, f"redirect to unsupported URL {new_url}")
+            if new_parts[:2] != urllib.parse.urlsplit(url)[:2]:
+                # credentials are only sent to the Readeck instance they belong to
+                headers = {k: v for k, v in headers.items() if k != "Authorization"}
+            logging.debug("redirected from %s to %s (HTTP %d)", url, new_url, response.status)
+            url = new_url
+        raise HTTPError(url, response.status, f"more than {MAX_REDIRECTS} redirects")
+
+    @contextmanager
+    def _request(
+        self, path: str, extra_headers: Optional[dict[str, str]] = None
+    ) -> Iterator[tuple[http.client.HTTPResponse, float]]:
+        """Send the request and retry failures as the scheduler allows.
+
+        Yields the response and its latency while holding a scheduler slot, so the slot is only
+        released once the body has been read. Each attempt takes its own slot: the backoff is
+        waited out without one, and a retry waits for the rate limit and any pause again.
+        """
+        if self.scheduler is None:
+            start = time.perf_counter()
+            response = self._send(path, extra_headers)
+            yield response, time.perf_counter() - start
+            return
+        name = endpoint(path)
+        attempt = 0
+        while True:
+            with self.scheduler.slot():
+                start = time.perf_counter()
+                try:
+                    response = self._send(path, extra_headers)
+                except (OSError, http.client.HTTPException) as e:
+                    self.scheduler.record(name, time.perf_counter() - start, None)
+                    if attempt >= self.scheduler.retries:
+                        raise
+                    delay = self.scheduler.backoff_delay(attempt)
+                    logging.warning("request for %s failed (%s), retrying in %.1f s", self.url(path), e, delay)
+                else:
+                    latency = time.perf_counter() - start
+                    self.scheduler.record(name, latency, response.status)
+                    if response.status not in RETRY_STATUSES or attempt >= self.scheduler.retries:
+                        yield response, latency
+                        return
+                    response.read()
+                    if response.will_close:
+                        self._drop_connection()
+                    delay = self.scheduler.backoff_delay(
+                        attempt, parse_retry_after(response.getheader("Retry-After"))
+                    )
+                    if response.status == 429:
+                        self.scheduler.pause(delay)
+                    logging.warning(
+                        "HTTP %d %s for %s, retrying in %.1f s", response.status, response.reason, self.url(path), delay
+                    )
+            stats.count("request retries")
+            time.sleep(delay)
+            attempt += 1
+
+    @contextmanager
+    def stream(self, path: str) -> Iterator[Body]:
+        """Context manager yielding the decoded body of `path` as a Body iterable over chunks.
+
+        Raises HTTPError for non-2xx responses. A cached body that the server confirms with 304
+        is read from the cache. The connection is only reused if the body was consumed completely.
+        """
+        url = self.url(path)
+        entry = self.cache.lookup(url) if self.cache is not None else None
+        name = endpoint(path)
+        with self._request(path, entry.validators() if entry is not None else None) as (response, latency):
+            chunks = None
+            body = None
+            try:
+                if response.status == 304 and entry is not None:
+                    logging.debug("not modified: %s", url)
+                    stats.count("response cache hits")
+                    response.read()
+                    yield Body(self.cache.iter_body(entry), entry.sha256)  # type: ignore[union-attr]
+                    return
+                if not 200 <= response.status < 300:
+                    response.read()
+                    raise HTTPError(url, response.status, response.reason)
+                if self.cache is not None:
+                    stats.count("response cache misses")
+                chunks = iter_decoded(response)
+                etag = response.getheader("ETag")
+                last_modified = response.getheader("Last-Modified")
+                if self.cache is not None and (etag or last_modified):
+                    chunks = self.cache.tee(url, chunks, etag=etag, last_modified=last_modified)
+                body = Body(chunks)
+                yield body
+            except BaseException:
+                self._drop_connection()
+                raise
+            finally:
+                stats.add_time(f"fetch {name}", latency + (body.elapsed if body is not None else 0.0))
+                if body is not None:
+                    stats.observe(f"bytes {name}", body.size, unit="B")
+                if chunks is not None:
+                    chunks.close()  # discards a partially written cache entry
+                if response.will_close or not response.isclosed():
+                    # the server wants to close, or the body was not read to the end
+                    self._drop_connection()
+
+    def get(self, path: str) -> bytes:
+        """Return the decoded body of `path`, see `stream`."""
+        with self.stream(path) as chunks:
+            return b"".join(chunks)
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
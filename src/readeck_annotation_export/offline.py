@@ -0,0 +1,142 @@
+"""Export of the annotations in saved article HTML files, without contacting Readeck."""
+
+import glob
+import json
+import logging
+import mmap
+import os
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from . import stats
+from .constants import DEFAULT_JOBS
+from .core import annotations_from_body
+
+ARTICLE_SUFFIXES = (".html", ".htm")
+TARBALL_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+@dataclass
+class LocalArticle:
+    """An article HTML file or archive member, and the bookmark JSON stored next to it (if any)."""
+
+    id: str
+    bookmark: dict
+    path: Optional[Path] = None  # files on disk are memory-mapped when they are processed
+    body: Optional[bytes] = None  # archive members are read while the archive is walked
+
+
+def local_article(stem: str, bookmark: Optional[dict], **source) -> LocalArticle:
+    if bookmark is None:
+        bookmark = {"title": stem, "url": "", "authors": [], "labels": [], "site_name": "", "published": None}
+    bookmark = {"id": stem} | bookmark
+    return LocalArticle(bookmark["id"], bookmark, **source)
+
+
+def _load_bookmark(f, name: str) -> Optional[dict]:
+    try:
+        return json.load(f)
+    except ValueError as e:
+        logging.warning("ignoring invalid bookmark JSON %s: %s", name, e)
+        return None
+
+
+def iter_files(paths: Iterable[Path]) -> Iterator[LocalArticle]:
+    """Articles in HTML files, with the bookmark from the .json file of the same name."""
+    for path in paths:
+        try:
+            with open(path.with_suffix(".json"), "r", encoding="utf-8") as f:
+                bookmark = _load_bookmark(f, f.name)
+        except FileNotFoundError:
+            bookmark = None
+        yield local_article(path.stem, bookmark, path=path)
+
+
+def iter_tarball(path: Path) -> Iterator[LocalArticle]:
+    """Articles in a (possibly compressed) tarball; the bookmark JSON members are read first."""
+    with tarfile.open(path, "r:*") as tar:
+        members = [m for m in tar.getmembers() if m.isfile()]
+        bookmarks = {}
+        for member in members:
+            stem, suffix = os.path.splitext(member.name)
+            if suffix == ".json":
+                bookmarks[stem] = _load_bookmark(tar.extractfile(member), f"{path}:{member.name}")
+        for member in members:
+            stem, suffix = os.path.splitext(member.name)
+            if suffix.lower() in ARTICLE_SUFFIXES:
+                body = tar.extractfile(member).read()  # type: ignore[union-attr]
+                yield local_article(os.path.basename(stem), bookmarks.get(stem), body=body)
+
+
+def _iter_path(path: Path) -> Iterator[LocalArticle]:
+    if path.is_dir():
+        yield from iter_files(
+            sorted(p for p in path.rglob("*") if p.suffix.lower() in ARTICLE_SUFFIXES and p.is_file())
+        )
+    elif path.name.lower().endswith(TARBALL_SUFFIXES):
+        yield from iter_tarball(path)
+    elif path.suffix.lower() in ARTICLE_SUFFIXES:
+        yield from iter_files([path])
+    else:
+        logging.warning("skipping %s: neither a directory, an HTML file nor a tarball", path)
+
+
+def iter_sources(sources: Iterable[str]) -> Iterator[LocalArticle]:
+    """Articles in each source: a directory (searched recursively), a glob pattern, a tarball or an HTML file."""
+    for source in sources:
+        if os.path.exists(source):
+            yield from _iter_path(Path(source))
+            continue
+        matches = sorted(glob.glob(source, recursive=True))
+        if not matches:
+            logging.warning("no files match %s", source)
+        for match in matches:
+            yield from _iter_path(Path(match))
+
+
+def local_annotations(article: LocalArticle) -> list[dict]:
+    stats.count("local articles")
+    if article.body is not None:
+        return annotations_from_body(article.body)
+    with open(article.path, "rb") as f:  # type: ignore[arg-type]
+        if os.fstat(f.fileno()).st_size == 0:
+            return []  # empty files cannot be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as body:
+            return annotations_from_body(body, path=article.path)
+
+
+def iter_local_articles(sources: Iterable[str], jobs: int = DEFAULT_JOBS, window: int | None = None) -> Iterator[tuple]:
+    """Like iter_articles, but for the articles found in `sources` (see iter_sources).
+
+    Up to `jobs` articles are processed at once (in the worker processes, if configured), and
+    at most `window` (default: 2 * jobs) are held in memory.
+    """
+    jobs = max(1, jobs)
+    window = max(1, window or 2 * jobs)
+    articles = iter_sources(sources)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        in_flight = deque()
+
+        def submit_next() -> bool:
+            for article in articles:
+                in_flight.append((article, executor.submit(local_annotations, article)))
+                return True
+            return False
+
+        while len(in_flight) < window and submit_next():
+            pass
+        while in_flight:
+            article, annotations = in_flight.popleft()
+            submit_next()
+            try:
+                result = article.bookmark | {"annotations": annotations.result()}
+            except Exception as e:
+                logging.error("failed to export article %s: %s", article.id, e)
+                stats.count("failed articles")
+                yield article.id, None, e
+            else:
+                yield article.id, result, None
@@ -0,0 +1,144 @@
+"""Output formats for exported articles.
+
+A renderer is created once per run, so everything that does not depend on the article (the
+Readeck link prefix, static properties, separators) is prepared up front. Articles are written
+piece by piece into the output stream instead of being assembled into one string first.
+"""
+
+import json
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterable, TextIO
+
+from . import stats
+
+
+@lru_cache(maxsize=4096)  # strptime is slow and many articles share a date
+def format_date(iso_date: str) -> str:
+    iso_date = iso_date.split("T")[0]
+    date = datetime.strptime(iso_date, "%Y-%m-%d")
+    day = date.day
+    suffix = (
+        "th" if 11 <= day <= 13 else {1: "st", 2: "nd", 3: "rd"}.get(day % 10, "th")
+    )
+    return "[[" + date.strftime(f"%b {day}{suffix}, %Y") + "]]"
+
+
+class Renderer:
+    header = ""
+    footer = ""  # written once after the last article by the CLI
+
+    def __init__(self, bookmarks_url: str):
+        self.bookmarks_url = bookmarks_url.rstrip("/") + "/"
+
+    def bookmark_url(self, article: dict) -> str:
+        return self.bookmarks_url + article["id"].lstrip("/")
+
+    def write_article(self, out: TextIO, article: dict):
+        raise NotImplementedError
+
+    def write(self, out: TextIO, articles: Iterable[dict]):
+        """Write the header and the articles, flushing after every article so output appears progressively."""
+        out.write(self.header)
+        clock = time.perf_counter
+        for article in articles:
+            start = clock()
+            self.write_article(out, article)
+            out.flush()
+            stats.add_time("render", clock() - start)
+
+
+class LogseqRenderer(Renderer):
+    """One collapsed Logseq block per article with its properties and a quote per annotation."""
+
+    header = "- ## 🔖 Articles\n"
+    footer = "\n"
+    STATIC_PROPERTIES = "\t  collapsed:: true\n\t  type:: [[Article]]\n"
+    QUOTE_SEPARATOR = "\n\t\t  > "
+    CODE_SEPARATOR = "\n\t\t  "
+
+    def write_article(self, out: TextIO, article: dict):
+        w = out.write
+        w(f'\t- [{article["title"]}]({self.bookmark_url(article)})\n')
+        w(self.STATIC_PROPERTIES)
+        w(f'\t  url:: {article["url"]}\n')
+        if article["authors"]:
+            w("\t  author:: " + ", ".join([f"[[{author}]]" for author in article["authors"]]) + "\n")
+        w("\t  links:: [[Readeck]]")
+        for label in article["labels"]:
+            w(f", [[{label}]]")
+        if article["site_name"]:
+            w(f', [[{article["site_name"]}]]')
+        w("\n")
+        if article.get("published", ""):
+            w("\t  date-published:: " + format_date(article["published"]) + "\n")
+        for annotation in article.get("annotations", []):
+            text = annotation["text"]
+            color = annotation["color"] and f'background-color:: {annotation["color"]}'
+            w(f"\t\t- {color}\n")
+            if "```" not in text:
+                w("\t\t  > ")
+                w(text.replace("\n", self.QUOTE_SEPARATOR))
+                w("\n")
+            else:
+                # Fix code block rendering. Logseq doesn't support indented code blocks in blockquotes.
+                # Use the following syntax instead:
+                # #+BEGIN_QUOTE
+                # ```
+                # code...
+                # ```
+                # #+END_QUOTE
+                w("\t\t  #+BEGIN_QUOTE\n\t\t  ")
+                w(text.replace("\n", self.CODE_SEPARATOR))
+                w("\n\t\t  #+END_QUOTE\n")
+
+
+class MarkdownRenderer(Renderer):
+    """Plain Markdown (e.g. for Obsidian): a heading and a metadata list per article, annotations as quotes."""
+
+    header = "# Articles\n"
+
+    def write_article(self, out: TextIO, article: dict):
+        w = out.write
+        w(f'\n## [{article["title"]}]({self.bookmark_url(article)})\n\n')
+        w(f'- URL: {article["url"]}\n')
+        if article["authors"]:
+            w("- Authors: " + ", ".join(article["authors"]) + "\n")
+        if article["site_name"]:
+            w(f'- Site: {article["site_name"]}\n')
+        if article["labels"]:
+            w("- Labels: " + ", ".join(article["labels"]) + "\n")
+        if article.get("published", ""):
+            w("- Published: " + article["published"].split("T")[0] + "\n")
+        for annotation in article.get("annotations", []):
+            w("\n> ")
+            w(annotation["text"].replace("\n", "\n> "))
+            w("\n")
+
+
+class JsonLinesRenderer(Renderer):
+    """One JSON object per line and article, for further processing by other tools."""
+
+    FIELDS = ("id", "title", "url", "authors", "labels", "site_name", "published")
+
+    def __init__(self, bookmarks_url: str):
+        super().__init__(bookmarks_url)
+        self.encoder = json.JSONEncoder(ensure_ascii=False)
+
+    def write_article(self, out: TextIO, article: dict):
+        record = {field: article.get(field) for field in self.FIELDS}
+        record["readeck_url"] = self.bookmark_url(article)
+        record["annotations"] = [
+            {"text": annotation["text"], "color": annotation["color"]}
+            for annotation in article.get("annotations", [])
+        ]
+        out.write(self.encoder.encode(record))
+        out.write("\n")
+
+
+RENDERERS: dict[str, type[Renderer]] = {
+    "logseq": LogseqRenderer,
+    "markdown": MarkdownRenderer,
+    "jsonl": JsonLinesRenderer,
+}
@@ -0,0 +1,166 @@
+"""Scheduling of the requests to Readeck: rate limit, adaptive concurrency and retry backoff."""
+
+import email.utils
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+from . import stats
+from .constants import DEFAULT_JOBS, DEFAULT_RETRIES, RETRY_AFTER_MAX, RETRY_BACKOFF, RETRY_MAX_BACKOFF
+
+# responses that are retried: the server is overloaded or temporarily failing
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# the concurrency limit is halved when the smoothed latency of an endpoint exceeds both of these
+LATENCY_FACTOR = 2.0  # times the lowest smoothed latency seen
+LATENCY_SLACK = 0.1  # seconds above the lowest smoothed latency seen
+LATENCY_SMOOTHING = 0.2  # weight of the newest latency in the moving average
+DECREASE_COOLDOWN = 1.0  # seconds between two reductions of the concurrency limit
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header (a delay in seconds or an HTTP date)."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """Allow `rate` requests per second on average, in bursts of at most `burst` requests."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how many seconds to wait before it may be used."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self) -> float:
+        """Wait for a token; returns the seconds waited."""
+        if (delay := self.reserve()) > 0:
+            time.sleep(delay)
+        return delay
+
+
+class FetchScheduler:
+    """Decide when requests are sent and how failed ones are retried.
+
+    At most `limit` requests are in flight. The limit starts at `max_concurrency`, is halved when
+    the server answers 429 or 5xx, a request fails, or the latency of an endpoint rises well above
+    the lowest seen, and grows back by one after `limit` successful requests. With a `rate`,
+    requests are also spaced by a token bucket. Failed requests are retried up to `retries` times
+    with jittered exponential backoff, waiting at least as long as the server's Retry-After.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_JOBS,
+        rate: Optional[float] = None,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = RETRY_BACKOFF,
+        max_backoff: float = RETRY_MAX_BACKOFF,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self.bucket = TokenBucket(rate) if rate else None
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._paused_until = 0.0
+        self._last_decrease = float("-inf")
+        self._successes = 0
+        self._latency: dict[str, float] = {}  # moving average per endpoint
+        self._base_latency: dict[str, float] = {}
+        self._random = random.Random()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Hold one of the `limit` request slots, after waiting for the rate limit and any pause."""
+        with self._condition:
+            while True:
+                pause = self._paused_until - time.monotonic()
+                if pause > 0:
+                    self._condition.wait(pause)
+                elif self._in_flight >= self.limit:
+                    self._condition.wait()
+                else:
+                    break
+            self._in_flight += 1
+        try:
+            if self.bucket is not None and (waited := self.bucket.acquire()):
+                stats.add_time("rate limit wait", waited)
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before retry number `attempt` + 1 (full jitter, at least `retry_after`)."""
+        delay = self._random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, RETRY_AFTER_MAX))
+        return delay
+
+    def pause(self, seconds: float):
+        """Send no new requests for `seconds`, e.g. after the server answered 429."""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def record(self, name: str, latency: float, status: Optional[int]):
+        """Adapt the concurrency limit to the outcome of a request to endpoint `name`.
+
+        `latency` is the time until the response headers arrived; `status` is None if the
+        request failed without a response.
+        """
+        with self._condition:
+            if status is None or status in RETRY_STATUSES:
+                self._decrease("request failed" if status is None else f"HTTP {status}")
+                return
+            average = self._latency.get(name, latency)
+            average += LATENCY_SMOOTHING * (latency - average)
+            self._latency[name] = average
+            base = self._base_latency[name] = min(self._base_latency.get(name, average), average)
+            if average > max(LATENCY_FACTOR * base, base + LATENCY_SLACK):
+                self._decrease(f"latency of {name} rose to {average * 1000:.0f} ms")
+            elif self.limit < self.max_concurrency:
+                self._successes += 1
+                if self._successes >= self.limit:
+                    self.limit += 1
+                    self._successes = 0
+                    self._condition.notify_all()
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        if self.limit == 1 or now - self._last_decrease < DECREASE_COOLDOWN:
+            return
+        self._last_decrease = now
+        self.limit = max(1, self.limit // 2)
+        self._successes = 0
+        stats.count("concurrency reductions")
+        logging.debug("%s, reducing concurrent requests to %d", reason, self.limit)
@@ -0,0 +1,131 @@
+"""Long-running local HTTP service that exports articles with warm connections and caches."""
+
+import json
+import logging
+import threading
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+
+from . import stats
+from .constants import DEFAULT_FORMAT, DEFAULT_JOBS, SERVE_MEMO_ENTRIES
+from .core import get_annotations, get_bookmark, markdown_conversion, new_renderer
+from .render import RENDERERS
+
+CONTENT_TYPES = {
+    "logseq": "text/markdown; charset=utf-8",
+    "markdown": "text/markdown; charset=utf-8",
+    "jsonl": "application/x-ndjson; charset=utf-8",
+}
+
+
+class ExportService:
+    """Export articles by ID, keeping everything that can be reused between requests.
+
+    The fetching threads live as long as the service, and with them their keep-alive
+    connections. The annotations of the last `max_entries` articles are kept in memory together
+    with the bookmark's `updated` timestamp, so an unchanged article costs a single request for
+    its bookmark.
+    """
+
+    def __init__(self, jobs: int = DEFAULT_JOBS, max_entries: int = SERVE_MEMO_ENTRIES):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="export")
+        self.max_entries = max_entries
+        self.renderers = {name: new_renderer(name) for name in RENDERERS}
+        self._memo: OrderedDict[str, tuple[str, list[dict]]] = OrderedDict()
+        self._lock = threading.Lock()
+        # load and initialize the converter (and its HTML parser) now rather than on the first request
+        markdown_conversion().converter.convert("<p>warm-up</p>")
+
+    def annotations(self, article_id: str, updated: str | None) -> list[dict]:
+        with self._lock:
+            entry = self._memo.get(article_id)
+            if entry is not None and updated is not None and entry[0] == updated:
+                self._memo.move_to_end(article_id)
+                stats.count("article memo hits")
+                return entry[1]
+        stats.count("article memo misses")
+        annotations = get_annotations(article_id)
+        if updated is not None:
+            with self._lock:
+                self._memo[article_id] = (updated, annotations)
+                self._memo.move_to_end(article_id)
+                while len(self._memo) > self.max_entries:
+                    self._memo.popitem(last=False)
+        return annotations
+
+    def article(self, article_id: str) -> dict:
+        bookmark = get_bookmark(article_id)
+        return bookmark | {"annotations": self.annotations(article_id, bookmark.get("updated"))}
+
+    def export(self, article_ids: list[str], output_format: str = DEFAULT_FORMAT) -> tuple[str, list[str]]:
+        """Render the articles in `output_format`; returns the output and the IDs that failed."""
+        renderer = self.renderers[output_format]
+        futures = [self.executor.submit(self.article, article_id) for article_id in article_ids]
+        articles = []
+        failed = []
+        for article_id, future in zip(article_ids, futures):
+            try:
+                articles.append(future.result())
+            except Exception as e:
+                logging.error("failed to export article %s: %s", article_id, e)
+                stats.count("failed articles")
+                failed.append(article_id)
+        out = StringIO()
+        renderer.write(out, articles)
+        out.write(renderer.footer)
+        return out.getvalue(), failed
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class ExportHandler(BaseHTTPRequestHandler):
+    """`GET /export?ids=ID,ID...&format=FORMAT` and `GET /stats`."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body are written separately
+    server: "ExportServer"
+
+    def do_GET(self):
+        parts = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(parts.query)
+        if parts.path == "/stats":
+            return self.respond(200, json.dumps(stats.report(), sort_keys=True), "application/json")
+        if parts.path != "/export":
+            return self.respond(404, "not found\n")
+        article_ids = [i for value in query.get("ids", []) for i in value.split(",") if i]
+        output_format = query.get("format", [self.server.default_format])[-1]
+        if not article_ids:
+            return self.respond(400, "missing ids\n")
+        if output_format not in RENDERERS:
+            return self.respond(400, f"unknown format {output_format!r}\n")
+        output, failed = self.server.service.export(article_ids, output_format)
+        if failed and len(failed) == len(article_ids):
+            return self.respond(502, "failed to export " + ", ".join(failed) + "\n")
+        headers = {"X-Failed-Articles": ",".join(failed)} if failed else {}
+        self.respond(200, output, CONTENT_TYPES[output_format], headers)
+
+    def respond(self, status: int, text: str, content_type: str = "text/plain; charset=utf-8", headers=None):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+
+class ExportServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], service: ExportService, default_format: str = DEFAULT_FORMAT):
+        super().__init__(address, ExportHandler)
+        self.service = service
+        self.default_format = default_format
@@ -0,0 +1,170 @@
+"""Counters and timings collected while exporting, reported in the run summary and by --stats."""
+
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Iterator
+
+_lock = threading.Lock()
+counters: Counter[str] = Counter()
+
+
+@dataclass
+class Series:
+    """Aggregate of the values observed under one name (durations are in seconds)."""
+
+    unit: str = ""
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+series: dict[str, Series] = {}
+
+
+def count(name: str, n: int = 1):
+    with _lock:
+        counters[name] += n
+
+
+def observe(name: str, value: float, unit: str = ""):
+    with _lock:
+        if name not in series:
+            series[name] = Series(unit)
+        series[name].add(value)
+
+
+def add_time(name: str, seconds: float):
+    observe(name, seconds, unit="s")
+
+
+@contextmanager
+def timer(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+
+def reset():
+    with _lock:
+        counters.clear()
+        series.clear()
+
+
+def snapshot() -> dict:
+    """All collected data in a form that can be pickled or serialized as JSON."""
+    with _lock:
+        return {"counters": dict(counters), "series": {name: asdict(s) for name, s in series.items()}}
+
+
+def merge(data: dict):
+    """Add a snapshot taken in another process."""
+    with _lock:
+        counters.update(data["counters"])
+        for name, values in data["series"].items():
+            s = series.setdefault(name, Series(values["unit"]))
+            s.count += values["count"]
+            s.total += values["total"]
+            s.max = max(s.max, values["max"])
+
+
+def hit_rates() -> dict[str, float]:
+    """Hit rate of every cache that counts "<name> hits" and "<name> misses"."""
+    with _lock:
+        caches = {name.rsplit(" ", 1)[0] for name in counters if name.endswith((" hits", " misses"))}
+        rates = {}
+        for cache in caches:
+            hits = counters[f"{cache} hits"]
+            total = hits + counters[f"{cache} misses"]
+            if total:
+                rates[cache] = hits / total
+        return rates
+
+
+def report() -> dict:
+    data = snapshot()
+    for name, values in data["series"].items():
+        values["mean"] = values["total"] / values["count"] if values["count"] else 0.0
+    data["hit_rates"] = hit_rates()
+    return data
+
+
+def _format_value(value: float, unit: str) -> str:
+    if unit == "s":
+        return f"{value * 1000:.1f} ms" if value < 1 else f"{value:.2f} s"
+    if unit == "B":
+        return f"{value / 1024:.1f} KiB" if value >= 1024 else f"{value:.0f} B"
+    return f"{value:.3g}"
+
+
+def format_report() -> str:
+    lines = []
+    with _lock:
+        for name, value in sorted(counters.items()):
+            lines.append(f"{name}: {value}")
+        for name, s in sorted(series.items()):
+            lines.append(
+                f"{name}: {s.count} × {_format_value(s.mean, s.unit)} mean, "
+                f"{_format_value(s.max, s.unit)} max, {_format_value(s.total, s.unit)} total"
+            )
+    for name, rate in sorted(hit_rates().items()):
+        lines.append(f"{name} hit rate: {rate:.1%}")
+    return "\n".join(lines)
+
+
+def summary() -> str:
+    with _lock:
+        return ", ".join(f"{name}: {value}" for name, value in sorted(counters.items()))
+
+
+class Profiler:
+    """cProfile over the main thread and every thread started while it is enabled.
+
+    Since Python 3.12 one cProfile profiler sees all threads. Before, each new thread starts a
+    profiler of its own, and their statistics are merged when they are dumped.
+    """
+
+    def __init__(self):
+        import cProfile
+
+        self._profilers = [cProfile.Profile()]
+        self._per_thread = sys.version_info < (3, 12)
+
+    def _start_thread(self, *args):
+        import cProfile
+
+        profiler = cProfile.Profile()
+        with _lock:
+            self._profilers.append(profiler)
+        profiler.enable()  # replaces this hook in the new thread
+
+    def enable(self):
+        if self._per_thread:
+            threading.setprofile(self._start_thread)
+        self._profilers[0].enable()
+
+    def disable(self):
+        if self._per_thread:
+            threading.setprofile(None)  # type: ignore[arg-type]
+        self._profilers[0].disable()
+
+    def dump_stats(self, path):
+        import pstats
+
+        with _lock:
+            profilers = list(self._profilers)
+        pstats.Stats(*profilers).dump_stats(path)
@@ -0,0 +1,114 @@
+"""Incremental export of the bookmarks that changed since the last run."""
+
+import json
+import logging
+import os
+import tempfile
+import urllib.parse
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional
+
+from .constants import DEFAULT_JOBS, SYNC_PAGE_SIZE
+from .core import iter_articles, readeck_get
+
+
+def default_state_path() -> Path:
+    base = os.environ.get("XDG_STATE_HOME") or os.path.join(os.path.expanduser("~"), ".local", "state")
+    return Path(base) / "readeck-annotation-export" / "sync-state.json"
+
+
+def load_state(path: Path) -> dict:
+    """Return the state stored at `path`.
+
+    {"last_sync": <timestamp or None>, "bookmarks": {id: updated}, "exported": [id, ...]}, where
+    "exported" lists the bookmarks that had annotations when they were last exported.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        state = {}
+    state.setdefault("last_sync", None)
+    state.setdefault("bookmarks", {})
+    state.setdefault("exported", [])
+    return state
+
+
+def save_state(path: Path, state: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def list_bookmarks(updated_since: Optional[str] = None, page_size: int = SYNC_PAGE_SIZE) -> Iterator[dict]:
+    """Yield all bookmarks (optionally only those updated after `updated_since`) page by page."""
+    offset = 0
+    while True:
+        query = {"limit": page_size, "offset": offset}
+        if updated_since:
+            query["updated_since"] = updated_since
+        page = readeck_get("/api/bookmarks?" + urllib.parse.urlencode(query))
+        yield from page
+        if len(page) < page_size:
+            return
+        offset += page_size
+
+
+def changed_bookmarks(state: dict, full: bool = False) -> list[dict]:
+    """Return the bookmarks that are new or whose `updated` differs from the recorded one.
+
+    When the whole library is listed (on the first sync or with `full`), bookmarks that were
+    deleted in Readeck are removed from `state`.
+    """
+    since = None if full else state["last_sync"]
+    known = {} if full else state["bookmarks"]
+    bookmarks = list(list_bookmarks(since))
+    changed = [b for b in bookmarks if known.get(b["id"]) != b["updated"]]
+    logging.info("%d bookmarks changed since %s", len(changed), since or "the beginning")
+    if since is None:
+        listed = {b["id"] for b in bookmarks}
+        deleted = [id for id in state["bookmarks"] if id not in listed]
+        for id in deleted:
+            del state["bookmarks"][id]
+        state["exported"] = [id for id in state["exported"] if id in listed]
+        if deleted:
+            logging.info("%d deleted bookmarks removed from the sync state", len(deleted))
+    return changed
+
+
+def export_changes(state: dict, changed: list[dict], jobs: int = DEFAULT_JOBS) -> Iterator[dict]:
+    """Fetch the annotations of `changed` and record the successful ones in `state`.
+
+    Yields the articles that have at least one annotation, in listing order, and those whose
+    annotations were all removed since they were exported (with an empty list), so their
+    previous export can be replaced. `last_sync` only advances (once the iterator is exhausted)
+    when every bookmark was exported, so failed ones are picked up again next time.
+    """
+    results = iter_articles([b["id"] for b in changed], jobs=jobs)
+    exported = set(state["exported"])
+    failed = 0
+    try:
+        for bookmark, (article_id, article, error) in zip(changed, results):
+            if error is not None:
+                failed += 1
+                continue
+            state["bookmarks"][article_id] = bookmark["updated"]
+            if article["annotations"]:
+                exported.add(article_id)
+                yield article
+            elif article_id in exported:
+                exported.discard(article_id)
+                yield article
+    finally:
+        state["exported"] = sorted(exported)
+    if failed:
+        logging.error("%d of %d changed bookmarks failed; they will be retried on the next sync", failed, len(changed))
+    elif changed:
+        state["last_sync"] = max((b["updated"] for b in changed), key=datetime.fromisoformat)
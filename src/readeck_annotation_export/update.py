@@ -0,0 +1,189 @@
+"""In-place update of the article blocks in an existing Logseq page."""
+
+import io
+import logging
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+
+from . import stats
+from .render import LogseqRenderer
+
+# first line of an article block, ending in the link to the bookmark in Readeck
+ARTICLE_LINE_RE = re.compile(r"\t- \[.*\]\((?P<url>[^()\s]+)\)\r?\n?")
+# first two lines of an annotation block written by LogseqRenderer
+ANNOTATION_LINE_RE = re.compile(r"\t\t- (?:background-color:: .*|None)?\r?\n?")
+QUOTE_PREFIXES = ("\t\t  > ", "\t\t  #+BEGIN_QUOTE")
+
+
+def index_blocks(lines: list[str]) -> tuple[dict[str, tuple[int, int]], int | None]:
+    """Map bookmark URLs to the (start, end) line range of their article block.
+
+    Only the children of the Articles heading are indexed, i.e. the blocks up to the next
+    top-level block. Also returns the line after the last article block (or after the heading
+    if there are no articles yet), where new articles are inserted; None if there is no heading.
+    """
+    blocks = {}
+    insert_at = None
+    in_articles = False
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith(LogseqRenderer.header.rstrip("\n")):
+            in_articles = True
+            insert_at = i + 1
+            i += 1
+            continue
+        if line.startswith("-"):
+            in_articles = False  # the next top-level block
+        m = ARTICLE_LINE_RE.fullmatch(line) if in_articles else None
+        if m is None:
+            i += 1
+            continue
+        start = i
+        i += 1
+        # properties, annotations and anything added in Logseq are indented deeper
+        while i < len(lines) and lines[i].startswith(("\t\t", "\t ")):
+            i += 1
+        blocks[m["url"]] = (start, i)
+        insert_at = i
+    return blocks, insert_at
+
+
+@dataclass
+class ArticleBlock:
+    """The lines of an article block, split into the ones written by the exporter and the rest."""
+
+    head: list[str]  # first line and properties
+    annotations: list[tuple[list[str], list[str]]]  # (lines of the annotation, notes nested under it)
+    added: list[str]  # other child blocks, added in Logseq
+
+    @property
+    def owned(self) -> str:
+        """The lines written by the exporter."""
+        return "".join(self.head) + "".join("".join(lines) for lines, _ in self.annotations)
+
+
+def parse_block(lines: list[str]) -> ArticleBlock:
+    """Split an article block into its first line, properties, annotations and added children.
+
+    Lines indented deeper than an annotation's quote are notes added in Logseq; so is any child
+    block that is not an annotation.
+    """
+    head = lines[:1]
+    i = 1
+    while i < len(lines) and lines[i].startswith("\t "):
+        head.append(lines[i])
+        i += 1
+    annotations = []
+    added = []
+    while i < len(lines):
+        start = i
+        i += 1
+        while i < len(lines) and not lines[i].startswith("\t\t-"):
+            i += 1
+        child = lines[start:i]
+        if ANNOTATION_LINE_RE.fullmatch(child[0]) and len(child) > 1 and child[1].startswith(QUOTE_PREFIXES):
+            annotations.append((
+                [line for line in child if not line.startswith("\t\t\t")],
+                [line for line in child if line.startswith("\t\t\t")],
+            ))
+        else:
+            added.extend(child)
+    return ArticleBlock(head, annotations, added)
+
+
+def merge_blocks(old: ArticleBlock, new: ArticleBlock) -> str:
+    """The exporter's lines of `new` with the notes and children added to `old` in Logseq.
+
+    Notes stay with the annotation of the same quote; the notes of annotations that were
+    removed become children of the article block.
+    """
+    notes: dict[str, list[list[str]]] = {}
+    for lines, nested in old.annotations:
+        if nested:
+            notes.setdefault("".join(lines[1:]), []).append(nested)
+    parts = list(new.head)
+    for lines, _ in new.annotations:
+        parts.extend(lines)
+        if stacked := notes.get("".join(lines[1:])):
+            parts.extend(stacked.pop(0))
+    for stacked in notes.values():
+        for nested in stacked:
+            parts.extend(line[1:] for line in nested)
+    parts.extend(old.added)
+    return "".join(parts)
+
+
+def update_page(path: Path, articles: Iterable[dict], renderer: LogseqRenderer):
+    """Replace the blocks of `articles` in the Logseq page at `path` and append the new ones.
+
+    Blocks of other articles and everything around them are kept as they are, and so are the
+    children added to an article block in Logseq. The page is replaced atomically, and only if
+    anything changed.
+    """
+    try:
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        lines = []
+    blocks, insert_at = index_blocks(lines)
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+    replaced: dict[int, tuple[int, str]] = {}  # start line -> (end line, new block)
+    appended = []
+    for article in articles:
+        buffer = io.StringIO()
+        renderer.write_article(buffer, article)
+        block = buffer.getvalue()
+        url = renderer.bookmark_url(article)
+        if url not in blocks:
+            appended.append(block)
+            blocks[url] = (-1, -1)  # an article given twice is only appended once
+            stats.count("articles added")
+            continue
+        start, end = blocks[url]
+        if start == -1:
+            stats.count("articles unchanged")
+            continue
+        old = parse_block(lines[start:end])
+        new = parse_block(block.splitlines(keepends=True))
+        if old.owned == new.owned:
+            stats.count("articles unchanged")
+            continue
+        replaced[start] = (end, merge_blocks(old, new))
+        stats.count("articles updated")
+    if not replaced and not appended:
+        logging.info("%s is up to date", path)
+        return
+    if insert_at is None:
+        # no Articles block yet: start one at the end of the page
+        lines.append(renderer.header)
+        insert_at = len(lines)
+    parts = []
+    i = 0
+    while i < len(lines):
+        if i == insert_at:
+            parts.extend(appended)
+            appended = []
+        if i in replaced:
+            i, block = replaced[i]
+            parts.append(block)
+            continue
+        parts.append(lines[i])
+        i += 1
+    parts.extend(appended)
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            f.writelines(parts)
+        if path.exists():
+            os.chmod(tmp_name, path.stat().st_mode & 0o7777)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
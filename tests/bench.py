@@ -0,0 +1,233 @@
+"""Benchmarks of the export stages on complex-example.html and on synthetic articles.
+
+    python tests/bench.py --output results.json
+    python tests/bench.py --baseline results.json --threshold 0.2
+
+Every stage is timed on every document (best of --repeat runs, in seconds per call). The results
+are written as JSON so runs on different commits can be compared; with --baseline the script
+exits with status 1 if any stage got slower than the baseline by more than --threshold.
+"""
+
+import argparse
+import io
+import json
+import platform
+import random
+import re
+import subprocess
+import sys
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.readeck_annotation_export.annotation_extractor import (  # noqa: E402
+    EXTRACTOR_BACKENDS,
+    extract_readeck_annotations,
+    extract_readeck_annotations_stream,
+)
+from src.readeck_annotation_export.conversion import MarkdownConversion  # noqa: E402
+from src.readeck_annotation_export.render import LogseqRenderer  # noqa: E402
+
+COMPLEX_EXAMPLE = Path(__file__).with_name("complex-example.html")
+ANNOTATION_ID_RE = re.compile(r'(data-annotation-id-value=")([^"]*)(")')
+STREAM_CHUNK_SIZE = 64 * 1024
+
+WORDS = (
+    "monad property based testing shrinking generator value tree composition closure iterator "
+    "strategy rust trait lifetime borrow checker function input output random seed"
+).split()
+COLORS = ["yellow", "red", "blue", "green"]
+
+
+def grow_complex_example(copies: int = 1) -> str:
+    """complex-example.html repeated `copies` times, with distinct annotation IDs in every copy."""
+    html = COMPLEX_EXAMPLE.read_text(encoding="utf-8")
+    return "".join(
+        ANNOTATION_ID_RE.sub(lambda m: f"{m[1]}{m[2]}-{i}{m[3]}", html) if i else html
+        for i in range(copies)
+    )
+
+
+def _sentence(rnd: random.Random, words: int = 12) -> str:
+    return " ".join(rnd.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _annotated_paragraph(rnd: random.Random, ann_id: str, occurrences: int) -> str:
+    """A paragraph with one annotation split into `occurrences` rd-annotation elements.
+
+    Readeck splits an annotation wherever it crosses an element boundary, so every other
+    fragment is inside a link or an emphasis, like in real articles.
+    """
+    color = rnd.choice(COLORS)
+
+    def fragment(text):
+        return (
+            f'<rd-annotation id="annotation-{ann_id}" data-annotation-id-value="{ann_id}" '
+            f'data-annotation-color="{color}">{text}</rd-annotation>'
+        )
+
+    parts = [_sentence(rnd), " "]
+    for i in range(occurrences):
+        text = _sentence(rnd, 6)
+        if i % 2:
+            tag = rnd.choice(["em", "strong", "code"])
+            parts.append(f'<a href="https://example.org/{ann_id}/{i}"><{tag}>{fragment(text)}</{tag}></a>')
+        else:
+            parts.append(fragment(text.replace(" ", " &amp; ", 1)))
+    parts += [" ", _sentence(rnd)]
+    return f"<p>{''.join(parts)}</p>"
+
+
+def synthetic_article(
+    paragraphs: int = 500,
+    depth: int = 3,
+    annotations: int = 50,
+    occurrences: int = 2,
+    section_size: int = 25,
+    seed: int = 0,
+) -> str:
+    """A Readeck-like article HTML document.
+
+    `paragraphs` sets the size, every paragraph is nested `depth` <div>s deep inside its
+    section, and `annotations` random paragraphs carry an annotation that is split into
+    `occurrences` rd-annotation elements.
+    """
+    rnd = random.Random(seed)
+    annotated = set(rnd.sample(range(paragraphs), min(annotations, paragraphs)))
+    parts = []
+    for i in range(paragraphs):
+        if i % section_size == 0:
+            if i:
+                parts.append("</section>")
+            parts.append(f'<section id="s{i // section_size}.readability-page-1"><h2>{_sentence(rnd, 4)}</h2>')
+        if i in annotated:
+            body = _annotated_paragraph(rnd, f"a{i:05d}", occurrences)
+        elif i % 7 == 3:
+            body = "<ul>" + "".join(f"<li>{_sentence(rnd, 5)}</li>" for _ in range(3)) + "</ul>"
+        elif i % 11 == 5:
+            body = f"<pre><code>fn f() -&gt; u32 {{ {rnd.randrange(100)} }}</code></pre>"
+        else:
+            body = f"<p>{_sentence(rnd)} <a href=\"https://example.org/{i}\">{_sentence(rnd, 3)}</a></p>"
+        parts.append("<div>" * depth + body + "</div>" * depth)
+    if paragraphs:
+        parts.append("</section>")
+    return "".join(parts)
+
+
+def stages(html: str) -> dict:
+    """The benchmarked functions for one document, each taking no arguments."""
+    body = html.encode("utf-8")
+    chunks = [body[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(body), STREAM_CHUNK_SIZE)]
+    annotations = extract_readeck_annotations(html)
+    # no memo: every run converts all annotations again
+    conversion = MarkdownConversion(max_entries=0)
+    texts = conversion.convert_batch([ann.text for ann in annotations])
+    article = {
+        "id": "bench",
+        "title": "Benchmark",
+        "url": "https://example.org/bench",
+        "authors": ["Ann"],
+        "labels": ["bench"],
+        "site_name": "example.org",
+        "published": "2024-03-02T10:00:00Z",
+        "annotations": [{"text": text, "color": ann.color} for text, ann in zip(texts, annotations)],
+    }
+    renderer = LogseqRenderer("http://localhost:8000/bookmarks")
+    functions = {
+        f"extract_readeck_annotations[{backend}]": lambda backend=backend: extract_readeck_annotations(
+            html, backend=backend
+        )
+        for backend in sorted(EXTRACTOR_BACKENDS)
+    }
+    functions["extract_readeck_annotations_stream"] = lambda: extract_readeck_annotations_stream(chunks)
+    functions["to_markdown"] = lambda: conversion.convert_batch([ann.text for ann in annotations])
+    functions["generate_article"] = lambda: renderer.write_article(io.StringIO(), article)
+    return functions
+
+
+def run(documents: dict[str, str], repeat: int = 5) -> dict[str, dict[str, float]]:
+    """Best time per call of every stage on every document."""
+    results = {}
+    for name, html in documents.items():
+        results[name] = {}
+        for stage, function in stages(html).items():
+            timer = timeit.Timer(function)
+            number, _ = timer.autorange()
+            results[name][stage] = min(timer.repeat(repeat, number)) / number
+    return results
+
+
+def compare(baseline: dict, results: dict, threshold: float) -> list[str]:
+    """Stages that are slower than in the baseline by more than `threshold` (0.2 = 20%)."""
+    regressions = []
+    for name, timings in results.items():
+        for stage, seconds in timings.items():
+            before = baseline.get(name, {}).get(stage)
+            if before and seconds > before * (1 + threshold):
+                regressions.append(f"{name} / {stage}: {before * 1000:.3f} ms -> {seconds * 1000:.3f} ms")
+    return regressions
+
+
+def commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--copies", type=int, default=4, help="copies of complex-example.html in the grown document")
+    parser.add_argument("--paragraphs", type=int, default=500, help="paragraphs of the synthetic article")
+    parser.add_argument("--depth", type=int, default=3, help="nesting depth of the synthetic paragraphs")
+    parser.add_argument("--annotations", type=int, default=50, help="annotations in the synthetic article")
+    parser.add_argument("--occurrences", type=int, default=2, help="rd-annotation elements per annotation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per stage, the best one counts")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown (default: %(default)s = 20%%)")
+    args = parser.parse_args(argv)
+
+    params = {
+        "copies": args.copies,
+        "paragraphs": args.paragraphs,
+        "depth": args.depth,
+        "annotations": args.annotations,
+        "occurrences": args.occurrences,
+        "seed": args.seed,
+    }
+    documents = {
+        "complex-example": COMPLEX_EXAMPLE.read_text(encoding="utf-8"),
+        f"complex-example x{args.copies}": grow_complex_example(args.copies),
+        "synthetic": synthetic_article(
+            args.paragraphs, args.depth, args.annotations, args.occurrences, seed=args.seed
+        ),
+    }
+    results = run(documents, args.repeat)
+    for name, timings in results.items():
+        print(f"{name} ({len(documents[name].encode('utf-8')) / 1024:.0f} KiB)")
+        for stage, seconds in timings.items():
+            print(f"  {stage}: {seconds * 1000:.3f} ms")
+
+    if args.output:
+        data = {"commit": commit(), "python": platform.python_version(), "params": params, "results": results}
+        Path(args.output).write_text(json.dumps(data, indent=2) + "\n", encoding="utf-8")
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        if baseline.get("params") != params:
+            print("warning: the baseline was run with different parameters", file=sys.stderr)
+        if regressions := compare(baseline["results"], results, args.threshold):
+            print(f"regressions (more than {args.threshold:.0%} slower):", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
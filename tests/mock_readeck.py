@@ -0,0 +1,273 @@
+"""A local stand-in for the Readeck API, for end-to-end and load tests of the exporter.
+
+    python tests/mock_readeck.py --bookmarks 200 --latency 0.05 --rate-limit 50
+
+Serves /api/bookmarks (with limit, offset and updated_since), /api/bookmarks/{id},
+/api/bookmarks/{id}/annotations and /api/bookmarks/{id}/article for generated bookmarks whose
+article is complex-example.html or a synthetic article (see bench.py). Latency, bandwidth,
+the rate of 500 errors and a request rate limit answered with 429 and Retry-After can be set.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+COMPLEX_EXAMPLE = Path(__file__).with_name("complex-example.html")
+ANNOTATION_RE = re.compile(
+    r'<rd-annotation[^>]*?data-annotation-id-value="(?P<id>[^"]*)"[^>]*?data-annotation-color="(?P<color>[^"]*)"'
+)
+SEND_CHUNK_SIZE = 16 * 1024
+
+
+@dataclass
+class MockBookmark:
+    bookmark: dict
+    article: bytes
+    annotations: list[dict] = field(default_factory=list)
+
+    @classmethod
+    def create(cls, id: str, article_html: str, updated: str = "2024-03-02T10:00:00Z") -> "MockBookmark":
+        annotations = {}
+        for m in ANNOTATION_RE.finditer(article_html):
+            annotations.setdefault(m["id"], {"id": m["id"], "text": "", "color": m["color"]})
+        bookmark = {
+            "id": id,
+            "title": f"Article {id}",
+            "url": f"https://example.org/{id}",
+            "authors": ["Ann"],
+            "labels": ["mock"],
+            "site_name": "example.org",
+            "published": "2024-03-02T10:00:00Z",
+            "updated": updated,
+        }
+        return cls(bookmark, article_html.encode("utf-8"), list(annotations.values()))
+
+
+def generate_bookmarks(count: int, synthetic: bool = False, unannotated: float = 0.0, seed: int = 0) -> dict:
+    """`count` bookmarks with IDs b00000, b00001, ...; a fraction `unannotated` has no annotations."""
+    rnd = random.Random(seed)
+    if synthetic:
+        from bench import synthetic_article
+        annotated_html = synthetic_article(seed=seed)
+    else:
+        annotated_html = COMPLEX_EXAMPLE.read_text(encoding="utf-8")
+    plain_html = ANNOTATION_RE.sub("<span", annotated_html).replace("</rd-annotation>", "</span>")
+    bookmarks = {}
+    for i in range(count):
+        id = f"b{i:05d}"
+        html = plain_html if rnd.random() < unannotated else annotated_html
+        bookmarks[id] = MockBookmark.create(id, html, updated=f"2024-03-02T10:{i // 60 % 60:02d}:{i % 60:02d}Z")
+    return bookmarks
+
+
+class MockReadeck(ThreadingHTTPServer):
+    """Threaded HTTP server answering Readeck API requests for `bookmarks` (see generate_bookmarks).
+
+    `latency` delays every response (seconds), `bandwidth` limits how fast bodies are sent
+    (bytes per second), a fraction `error_rate` of the requests fails with 500, and more than
+    `rate_limit` requests per second are answered with 429 and `Retry-After: retry_after`.
+    Requests and response statuses are counted in `requests` and `statuses`.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        bookmarks: dict,
+        address: tuple[str, int] = ("127.0.0.1", 0),
+        token: str = "token",
+        latency: float = 0.0,
+        bandwidth: float | None = None,
+        error_rate: float = 0.0,
+        rate_limit: float | None = None,
+        retry_after: int = 1,
+        seed: int = 0,
+    ):
+        super().__init__(address, MockReadeckHandler)
+        self.bookmarks = bookmarks
+        self.token = token
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.requests: Counter[str] = Counter()
+        self.statuses: Counter[int] = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_requests = 0
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockReadeck":
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "MockReadeck":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def admit(self) -> int | None:
+        """Decide whether the next request fails: returns 429 or 500, or None to serve it."""
+        with self._lock:
+            if self.rate_limit is not None:
+                now = time.monotonic()
+                if now - self._window_start >= 1.0:
+                    self._window_start = now
+                    self._window_requests = 0
+                self._window_requests += 1
+                if self._window_requests > self.rate_limit:
+                    return 429
+            if self.error_rate and self._random.random() < self.error_rate:
+                return 500
+        return None
+
+    def record(self, endpoint: str, status: int):
+        with self._lock:
+            self.requests[endpoint] += 1
+            self.statuses[status] += 1
+
+
+class MockReadeckHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body are written separately
+    server: MockReadeck
+
+    def do_GET(self):
+        parts = urllib.parse.urlsplit(self.path)
+        segments = parts.path.strip("/").split("/")
+        endpoint = "/" + "/".join("{id}" if i == 2 else s for i, s in enumerate(segments))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.headers.get("Authorization") != f"Bearer {self.server.token}":
+            return self.send_body(endpoint, 401, b'{"message": "unauthorized"}')
+        if (status := self.server.admit()) is not None:
+            headers = {"Retry-After": str(self.server.retry_after)} if status == 429 else {}
+            return self.send_body(endpoint, status, b'{"message": "try again"}', headers=headers)
+        if segments[:2] != ["api", "bookmarks"] or len(segments) > 4:
+            return self.send_body(endpoint, 404, b'{"message": "not found"}')
+        if len(segments) == 2:
+            query = dict(urllib.parse.parse_qsl(parts.query))
+            items = [b.bookmark for _, b in sorted(self.server.bookmarks.items())]
+            if since := query.get("updated_since"):
+                items = [b for b in items if b["updated"] > since]
+            offset = int(query.get("offset", 0))
+            items = items[offset:offset + int(query.get("limit", 30))]
+            return self.send_body(endpoint, 200, json.dumps(items).encode())
+        bookmark = self.server.bookmarks.get(segments[2])
+        if bookmark is None:
+            return self.send_body(endpoint, 404, b'{"message": "not found"}')
+        if len(segments) == 3:
+            return self.send_body(endpoint, 200, json.dumps(bookmark.bookmark).encode())
+        if segments[3] == "annotations":
+            return self.send_body(endpoint, 200, json.dumps(bookmark.annotations).encode())
+        if segments[3] == "article":
+            etag = '"%s"' % hashlib.sha256(bookmark.article).hexdigest()[:32]
+            if self.headers.get("If-None-Match") == etag:
+                return self.send_body(endpoint, 304, b"", headers={"ETag": etag})
+            return self.send_body(endpoint, 200, bookmark.article, "text/html; charset=utf-8", {"ETag": etag})
+        return self.send_body(endpoint, 404, b'{"message": "not found"}')
+
+    def send_body(
+        self,
+        endpoint: str,
+        status: int,
+        body: bytes,
+        content_type: str = "application/json",
+        headers: dict[str, str] | None = None,
+    ):
+        if body and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body, compresslevel=1)
+            headers = (headers or {}) | {"Content-Encoding": "gzip"}
+        # counted before sending, so the counts are complete as soon as the client has the response
+        self.server.record(endpoint, status)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        bandwidth = self.server.bandwidth
+        for i in range(0, len(body), SEND_CHUNK_SIZE):
+            chunk = body[i:i + SEND_CHUNK_SIZE]
+            self.wfile.write(chunk)
+            if bandwidth:
+                time.sleep(len(chunk) / bandwidth)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--bookmarks", type=int, default=100, help="number of bookmarks to serve")
+    parser.add_argument("--synthetic", action="store_true", help="serve synthetic articles instead of complex-example.html")
+    parser.add_argument("--unannotated", type=float, default=0.0, help="fraction of bookmarks without annotations")
+    parser.add_argument("--latency", type=float, default=0.0, help="delay of every response in seconds")
+    parser.add_argument("--bandwidth", type=float, help="bytes per second per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with 500")
+    parser.add_argument("--rate-limit", type=float, help="requests per second before answering 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After of 429 responses in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def server_from_arguments(args: argparse.Namespace, address: tuple[str, int] = ("127.0.0.1", 0)) -> MockReadeck:
+    bookmarks = generate_bookmarks(args.bookmarks, args.synthetic, args.unannotated, args.seed)
+    return MockReadeck(
+        bookmarks,
+        address,
+        token=getattr(args, "token", "token"),
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--token", default="token", help="expected READECK_AUTH_TOKEN")
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+    server = server_from_arguments(args, (args.host, args.port))
+    print(f"serving {len(server.bookmarks)} bookmarks on {server.url}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"requests: {dict(server.requests)}, statuses: {dict(server.statuses)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,29 @@
 import unittest
 
-from src.readeck_annotation_export.annotation_extractor import ExtractedAnnotation, extract_readeck_annotations
+from src.readeck_annotation_export.annotation_extractor import (
+    EXTRACTOR_BACKENDS,
+    ExtractedAnnotation,
+    extract_readeck_annotations,
+    extract_readeck_annotations_stream,
+    new_extractor,
+    prescan,
+)
 
 
-class TestExtractReadeckAnnotations(unittest.TestCase):
+class ExtractReadeckAnnotationsCases:
+    """Cases run against every extractor backend, see the TestExtractReadeckAnnotations classes below."""
+
+    backend: str
+
+    def extract(self, html):
+        return extract_readeck_annotations(html, backend=self.backend)
+
     def test_empty_input_returns_empty_list(self):
-        self.assertEqual(extract_readeck_annotations(""), [])
+        self.assertEqual(self.extract(""), [])
 
     def test_single_annotation_plain_text(self):
         html = '<rd-annotation data-annotation-id-value="id1">hello</rd-annotation>'
-        out = [a.text for a in extract_readeck_annotations(html)]
+        out = [a.text for a in self.extract(html)]
         self.assertEqual(out, ["hello"])
 
     def test_annotation_with_section_context(self):
@@ -18,7 +32,7 @@ class TestExtractReadeckAnnotations(unittest.TestCase):
             "<div><p><rd-annotation data-annotation-id-value=\"id2\">A</rd-annotation></p></div>"
             "</section>"
         )
-        out = extract_readeck_annotations(html)
+        out = self.extract(html)
         # annotation sits inside a section; extractor should emit tags after the last <section>
         self.assertEqual(out, [ExtractedAnnotation(id="id2", color=None, text="<div><p>A</p></div>")])
 
@@ -31,21 +45,30 @@ class TestExtractReadeckAnnotations(unittest.TestCase):
             '<rd-annotation data-annotation-id-value="same">two</rd-annotation>'
             "</p></div>"
         )
-        out = extract_readeck_annotations(html)
+        out = self.extract(html)
         # both occurrences share the same context (div,p) -> should be merged into single wrapper
         self.assertEqual(out, [ExtractedAnnotation(id="same", color=None, text="<div><p>one</p></div><div><p>two</p></div>")])
 
     def test_preserve_entities_and_charrefs(self):
         html = '<rd-annotation data-annotation-id-value="e1">&amp; &#169;</rd-annotation>'
-        out = extract_readeck_annotations(html)
+        out = self.extract(html)
         self.assertEqual(out, [ExtractedAnnotation(id="e1", color=None, text="&amp; &#169;")])
 
+    def test_context_tags_keep_original_start_tag_text(self):
+        html = (
+            "<section><p title='a &#34;b&#34;' class=x>"
+            '<rd-annotation data-annotation-id-value="raw">A</rd-annotation>'
+            "</p></section>"
+        )
+        out = self.extract(html)
+        self.assertEqual(out, [ExtractedAnnotation(id="raw", color=None, text="<p title='a &#34;b&#34;' class=x>A</p>")])
+
     def test_order_by_first_seen(self):
         html = (
             '<rd-annotation data-annotation-id-value="b">B</rd-annotation>'
             '<rd-annotation data-annotation-id-value="a">A</rd-annotation>'
         )
-        out = extract_readeck_annotations(html)
+        out = self.extract(html)
         # first seen b then a -> order should reflect that
         self.assertEqual(out, [
             ExtractedAnnotation(id="b", color=None, text="B"),
@@ -69,7 +92,7 @@ class TestExtractReadeckAnnotations(unittest.TestCase):
                 </ul>
             </section>
         """
-        out = extract_readeck_annotations(html)
+        out = self.extract(html)
         self.assertEqual(out, [
             ExtractedAnnotation(id="list", color=None, text="<ul><li>Item 1</li><li>Item<strong> 2</strong></li></ul>")
         ])
@@ -80,7 +103,7 @@ class TestExtractReadeckAnnotations(unittest.TestCase):
             '<div></div>'
             '<rd-annotation data-annotation-id-value="first">Second</rd-annotation>'
         )
-        out = extract_readeck_annotations(html)
+        out = self.extract(html)
         self.assertEqual(out, [
             ExtractedAnnotation(id="first", color=None, text="FirstSecond"),
         ])
@@ -89,7 +112,7 @@ class TestExtractReadeckAnnotations(unittest.TestCase):
         # load html from ./tests/complex-example.html
         with open("tests/complex-example.html", "r", encoding="utf-8") as f:
             html = f.read()
-        out = extract_readeck_annotations(html)
+        out = self.extract(html)
         for ann in out:
             print(f'ExtractedAnnotation(id="{ann.id}", color="{ann.color}", text="""{ann.text}""")')
         expected = [
@@ -131,6 +154,116 @@ ExtractedAnnotation(id="GrTY4hq1UNuYcqyYA1pzzP", color="yellow", text="""<div><h
             self.assertEqual(expected[i], out[i])
 
 
+for _backend in EXTRACTOR_BACKENDS:
+    _name = "TestExtractReadeckAnnotations_" + _backend.replace(".", "_")
+    globals()[_name] = type(_name, (ExtractReadeckAnnotationsCases, unittest.TestCase), {"backend": _backend})
+
+
+class TestExtractReadeckAnnotationsStream(unittest.TestCase):
+    def test_empty_stream_returns_empty_list(self):
+        self.assertEqual(extract_readeck_annotations_stream([]), [])
+
+    def test_chunked_input_matches_whole_document(self):
+        with open("tests/complex-example.html", "r", encoding="utf-8") as f:
+            html = f.read()
+        data = html.encode("utf-8")
+        expected = extract_readeck_annotations(html)
+        # small odd chunk sizes split tags, entities and multi-byte characters
+        for chunk_size in (1, 7, 1000, len(data)):
+            chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(extract_readeck_annotations_stream(chunks), expected)
+
+
+class TestPrescan(unittest.TestCase):
+    def test_document_without_annotations_is_dropped(self):
+        self.assertEqual(prescan("<section><p>nothing here</p></section>"), "")
+
+    def test_prefix_is_reduced_to_open_elements(self):
+        html = (
+            "<div><p>intro</p><img src=\"a.png\"/>"
+            '<p class="x"><rd-annotation data-annotation-id-value="a">A</rd-annotation></p></div>'
+        )
+        self.assertEqual(
+            prescan(html),
+            '<div><p class="x"><rd-annotation data-annotation-id-value="a">A</rd-annotation></p></div>',
+        )
+
+    def test_unannotated_sections_are_dropped(self):
+        html = (
+            '<section><p><rd-annotation data-annotation-id-value="a">A</rd-annotation></p></section>'
+            "<section><div><p>skipped</p></div></section>"
+            '<section><p><rd-annotation data-annotation-id-value="a">B</rd-annotation></p></section>'
+        )
+        self.assertNotIn("skipped", prescan(html))
+        self.assertEqual(extract_readeck_annotations(html), extract_readeck_annotations(html, use_prescan=False))
+
+    def test_unbalanced_section_is_kept(self):
+        html = (
+            '<section><p><rd-annotation data-annotation-id-value="a">A</rd-annotation></p></section>'
+            "<section><p><img src=x>kept</p></section>"
+            '<section><p><rd-annotation data-annotation-id-value="a">B</rd-annotation></p></section>'
+        )
+        self.assertIn("kept", prescan(html))
+        self.assertEqual(extract_readeck_annotations(html), extract_readeck_annotations(html, use_prescan=False))
+
+    def test_unquoted_value_ending_in_slash_is_not_self_closing(self):
+        html = '<p><img src=a.png/><rd-annotation data-annotation-id-value="a">A</rd-annotation></p>'
+        self.assertEqual(
+            extract_readeck_annotations(html, backend="html.parser"),
+            extract_readeck_annotations(html, use_prescan=False, backend="html.parser"),
+        )
+        html = "<section><p><img src=a.png/></p></section>" + html
+        self.assertEqual(
+            extract_readeck_annotations(html, backend="html.parser"),
+            extract_readeck_annotations(html, use_prescan=False, backend="html.parser"),
+        )
+
+    def test_complex_example_matches_full_parse(self):
+        with open("tests/complex-example.html", "r", encoding="utf-8") as f:
+            html = f.read()
+        self.assertEqual(extract_readeck_annotations(html), extract_readeck_annotations(html, use_prescan=False))
+
+
+class TestScannerBackend(unittest.TestCase):
+    def assertSameAsHtmlParser(self, html):
+        self.assertEqual(
+            extract_readeck_annotations(html, use_prescan=False, backend="scanner"),
+            extract_readeck_annotations(html, use_prescan=False, backend="html.parser"),
+        )
+
+    def test_unknown_backend_is_rejected(self):
+        with self.assertRaises(ValueError):
+            new_extractor("lxml")
+
+    def test_complex_example_matches_html_parser(self):
+        with open("tests/complex-example.html", "r", encoding="utf-8") as f:
+            html = f.read()
+        self.assertSameAsHtmlParser(html)
+        data = html.encode("utf-8")
+        for chunk_size in (1, 7, 1000):
+            chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(
+                    extract_readeck_annotations_stream(chunks, backend="scanner"),
+                    extract_readeck_annotations(html, backend="html.parser"),
+                )
+
+    def test_unusual_markup_falls_back_to_html_parser(self):
+        ann = '<rd-annotation data-annotation-id-value="a">{}</rd-annotation>'
+        for html in (
+            "<p>" + ann.format("x &#12a; y") + "</p>",  # unterminated character reference
+            "<p>" + ann.format("x &amp y") + "</p>",
+            '<div title=a"b><p>' + ann.format("x") + "</p></div>",  # stray quote in a tag
+            "<p>" + ann.format("<script>'</p>'</script>x") + "</p>",  # raw text element
+            "<p>" + ann.format("x <![CDATA[y]]> z <?pi?>") + "</p>",
+            "<p>" + ann.format("x < y") + "</p><p>unclosed",
+            "<p><img src=a.png/>" + ann.format("A") + "</p>",  # unquoted value ending in "/"
+        ):
+            with self.subTest(html=html):
+                self.assertSameAsHtmlParser(html)
+
+
 class TestFindCommonPrefix(unittest.TestCase):
     def test_empty_list_returns_empty(self):
         from src.readeck_annotation_export.annotation_extractor import find_common_prefix
@@ -0,0 +1,23 @@
+import unittest
+
+from bench import compare, grow_complex_example, synthetic_article
+from src.readeck_annotation_export.annotation_extractor import extract_readeck_annotations
+
+
+class TestBench(unittest.TestCase):
+    def test_synthetic_article(self):
+        html = synthetic_article(paragraphs=60, depth=4, annotations=8, occurrences=3)
+        self.assertEqual(html.count("<rd-annotation"), 24)
+        annotations = extract_readeck_annotations(html)
+        self.assertEqual(len(annotations), 8)
+        self.assertTrue(annotations[0].text.startswith("<div>" * 4 + "<p>"))
+        self.assertEqual(synthetic_article(paragraphs=60, seed=1), synthetic_article(paragraphs=60, seed=1))
+
+    def test_grown_complex_example_has_distinct_annotations(self):
+        once = len(extract_readeck_annotations(grow_complex_example(1)))
+        self.assertEqual(len(extract_readeck_annotations(grow_complex_example(3))), 3 * once)
+
+    def test_compare(self):
+        baseline = {"doc": {"parse": 1.0, "render": 1.0}}
+        results = {"doc": {"parse": 1.1, "render": 1.5, "new stage": 9.0}}
+        self.assertEqual(compare(baseline, results, 0.2), ["doc / render: 1000.000 ms -> 1500.000 ms"])
@@ -0,0 +1,87 @@
+import hashlib
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from src.readeck_annotation_export.cache import ExtractionCache, ResponseCache
+
+ANNOTATIONS = [{"text": "> quote", "color": "yellow"}]
+
+
+class TestExtractionCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "extraction.sqlite3"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_roundtrip(self):
+        cache = ExtractionCache(self.path, version="1")
+        self.assertIsNone(cache.get("abc"))
+        cache.put("abc", ANNOTATIONS)
+        self.assertEqual(cache.get("abc"), ANNOTATIONS)
+        cache.close()
+        cache = ExtractionCache(self.path, version="1")
+        self.assertEqual(cache.get("abc"), ANNOTATIONS)
+        cache.close()
+
+    def test_other_version_is_discarded(self):
+        cache = ExtractionCache(self.path, version="1")
+        cache.put("abc", ANNOTATIONS)
+        cache.close()
+        cache = ExtractionCache(self.path, version="2")
+        self.assertIsNone(cache.get("abc"))
+        cache.close()
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = ExtractionCache(self.path, version="1", max_bytes=100)
+        for key in ("a", "b", "c"):
+            cache.put(key, ANNOTATIONS)
+            time.sleep(0.01)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("c"), ANNOTATIONS)
+        cache.close()
+
+    def test_expired_entries_are_evicted(self):
+        cache = ExtractionCache(self.path, version="1")
+        cache.put("abc", ANNOTATIONS)
+        cache.close()
+        cache = ExtractionCache(self.path, version="1", max_age=0)
+        self.assertIsNone(cache.get("abc"))
+        cache.close()
+
+
+class TestResponseCache(unittest.TestCase):
+    URL = "http://localhost/api/bookmarks/abc/article"
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_roundtrip(self):
+        entry = self.cache.store(self.URL, [b"<p>", b"body</p>"], etag='"v1"')
+        self.assertEqual(self.cache.read(entry), b"<p>body</p>")
+        self.assertEqual(entry.sha256, hashlib.sha256(b"<p>body</p>").hexdigest())
+        self.assertEqual(entry.validators(), {"If-None-Match": '"v1"'})
+
+    def test_replaced_entry_is_not_read_with_stale_metadata(self):
+        old = self.cache.store(self.URL, [b"old"], etag='"v1"')
+        new = self.cache.store(self.URL, [b"newer"], etag='"v2"')
+        self.assertEqual(self.cache.read(new), b"newer")
+        with self.assertRaises(OSError):
+            self.cache.read(old)
+
+    def test_abandoned_body_leaves_no_files(self):
+        def chunks():
+            yield b"partial"
+            raise ConnectionError
+
+        with self.assertRaises(ConnectionError):
+            self.cache.store(self.URL, chunks(), etag='"v1"')
+        self.assertIsNone(self.cache.lookup(self.URL))
+        self.assertEqual(list(Path(self.tmp.name).iterdir()), [])
@@ -0,0 +1,80 @@
+import sqlite3
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from markdownify import markdownify
+
+from src.readeck_annotation_export.conversion import MarkdownConversion
+
+
+class TestMarkdownConversion(unittest.TestCase):
+    HTML = [
+        "<div><h2>Title</h2><ul><li>one</li><li><em>two</em></li></ul></div>",
+        "<div><p>a &amp; b</p></div>",
+    ]
+
+    def test_matches_markdownify(self):
+        conversion = MarkdownConversion()
+        expected = [markdownify(html, heading_style="ATX", bullets="*").strip() for html in self.HTML]
+        self.assertEqual(conversion.convert_batch(self.HTML), expected)
+        self.assertEqual(conversion.convert(self.HTML[0]), expected[0])
+
+    def test_results_are_memoized(self):
+        conversion = MarkdownConversion(max_entries=1)
+        first = conversion.convert_batch(self.HTML + self.HTML)
+        self.assertEqual(first[:2], first[2:])
+        self.assertEqual(len(conversion._memo), 1)
+        conversion.converter = None  # any further conversion would fail
+        self.assertEqual(conversion.convert(self.HTML[1]), first[1])
+
+    def test_persistent_store_is_reused(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "markdown.sqlite3"
+            conversion = MarkdownConversion(store_path=path)
+            expected = conversion.convert_batch(self.HTML)
+            conversion.close()
+            conversion = MarkdownConversion(store_path=path)
+            conversion.converter = None
+            self.assertEqual(conversion.convert_batch(self.HTML), expected)
+            conversion.close()
+
+    def stored_keys(self, path: Path) -> set[str]:
+        with sqlite3.connect(path) as db:
+            keys = {key for (key,) in db.execute("SELECT key FROM markdown")}
+        db.close()
+        return keys
+
+    def test_store_drops_other_converter_versions(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "markdown.sqlite3"
+            with mock.patch("src.readeck_annotation_export.conversion.version", return_value="0.0"):
+                conversion = MarkdownConversion(store_path=path)
+                conversion.convert_batch(self.HTML)
+                conversion.close()
+            self.assertEqual(len(self.stored_keys(path)), 2)
+            MarkdownConversion(store_path=path).close()
+            self.assertEqual(self.stored_keys(path), set())
+
+    def test_store_evicts_least_recently_used_rows(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "markdown.sqlite3"
+            conversion = MarkdownConversion(max_entries=0, store_path=path, max_bytes=10)
+            for html in self.HTML + ["<p>c</p>"]:
+                conversion.convert(html)
+                time.sleep(0.01)
+            conversion.close()
+            keys = self.stored_keys(path)
+            self.assertNotIn(conversion.key(self.HTML[0]), keys)
+            self.assertIn(conversion.key("<p>c</p>"), keys)
+
+    def test_store_evicts_expired_rows(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "markdown.sqlite3"
+            conversion = MarkdownConversion(store_path=path)
+            conversion.convert_batch(self.HTML)
+            conversion.close()
+            MarkdownConversion(store_path=path, max_age=0).close()
+            self.assertEqual(self.stored_keys(path), set())
@@ -0,0 +1,46 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from mock_readeck import MockReadeck, generate_bookmarks
+from src.readeck_annotation_export import core, stats
+
+
+class TestGetAnnotations(unittest.TestCase):
+    def setUp(self):
+        self.server = MockReadeck(generate_bookmarks(1)).start()
+        self.addCleanup(self.server.stop)
+        environ = mock.patch.dict(os.environ, READECK_URL=self.server.url, READECK_AUTH_TOKEN="token")
+        environ.start()
+        self.addCleanup(environ.stop)
+        core.configure_client()
+        self.addCleanup(core.readeck_client().close)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        core.configure_extraction(cache_path=Path(tmp.name) / "extraction.sqlite3")
+        self.addCleanup(core.configure_extraction)
+        stats.reset()
+
+    def test_streamed_article_is_cached_by_its_digest(self):
+        # the body is never buffered as a whole without worker processes
+        with mock.patch.object(core, "annotations_from_body", side_effect=AssertionError):
+            first = core.get_annotations("b00000")
+            self.assertEqual(stats.counters["extraction cache misses"], 1)
+            self.assertEqual(core.get_annotations("b00000"), first)
+        self.assertEqual(stats.counters["extraction cache hits"], 1)
+        sha256 = hashlib.sha256(self.server.bookmarks["b00000"].article).hexdigest()
+        self.assertEqual(core._extraction_cache.get(sha256), first)
+
+
+class TestProcesses(unittest.TestCase):
+    def test_process_count(self):
+        self.addCleanup(core.configure_processes, None)
+        core.configure_processes(3)
+        self.assertEqual(core.process_count(), 3)
+        core.configure_processes(0)
+        self.assertEqual(core.process_count(), os.cpu_count())
+        core.configure_processes(None)
+        self.assertEqual(core.process_count(), 0)
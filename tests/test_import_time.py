@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+# modules that a usage error or --help must not pay for
+HEAVY_MODULES = {
+    "markdownify",
+    "bs4",
+    "sqlite3",
+    "multiprocessing",
+    "http.client",
+    "json",
+    "datetime",
+    "readeck_annotation_export.core",
+}
+
+
+def imported_modules(code: str) -> set[str]:
+    """Names of the modules imported by running `code`, according to `python -X importtime`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env=os.environ | {"PYTHONPATH": str(SRC)},
+        capture_output=True,
+        text=True,
+    )
+    return {
+        line.rsplit("|", 1)[1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:") and "|" in line
+    }
+
+
+class TestImportTime(unittest.TestCase):
+    def test_cli_imports_no_heavy_modules(self):
+        modules = imported_modules("import readeck_annotation_export.cli")
+        self.assertIn("readeck_annotation_export.cli", modules)
+        self.assertEqual(modules & HEAVY_MODULES, set())
+
+    def test_usage_error_imports_no_heavy_modules(self):
+        modules = imported_modules("from readeck_annotation_export.cli import main; main(['--format', 'nope', 'id'])")
+        self.assertIn("argparse", modules)
+        self.assertEqual(modules & HEAVY_MODULES, set())
+
+    def test_core_defers_markdownify_and_multiprocessing(self):
+        modules = imported_modules("import readeck_annotation_export.core")
+        self.assertIn("readeck_annotation_export.core", modules)
+        self.assertEqual(modules & {"markdownify", "bs4", "multiprocessing"}, set())
+
+    def test_cli_choices_match_implementations(self):
+        from src.readeck_annotation_export.annotation_extractor import EXTRACTOR_BACKENDS
+        from src.readeck_annotation_export.constants import OUTPUT_FORMATS, PARSERS
+        from src.readeck_annotation_export.render import RENDERERS
+
+        self.assertEqual(set(PARSERS), set(EXTRACTOR_BACKENDS))
+        self.assertEqual(set(OUTPUT_FORMATS), set(RENDERERS))
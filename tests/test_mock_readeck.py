@@ -0,0 +1,41 @@
+import json
+import unittest
+
+from mock_readeck import MockReadeck, generate_bookmarks
+from src.readeck_annotation_export.annotation_extractor import extract_readeck_annotations
+from src.readeck_annotation_export.http_client import HTTPError, ReadeckClient
+
+
+class TestMockReadeck(unittest.TestCase):
+    def serve(self, **options):
+        server = MockReadeck(generate_bookmarks(3, unannotated=0.5, seed=1), **options).start()
+        self.addCleanup(server.stop)
+        client = ReadeckClient(server.url, {"Authorization": "Bearer token"})
+        self.addCleanup(client.close)
+        return server, client
+
+    def test_serves_bookmarks_annotations_and_articles(self):
+        server, client = self.serve()
+        page = json.loads(client.get("/api/bookmarks?limit=2&offset=1"))
+        self.assertEqual([b["id"] for b in page], ["b00001", "b00002"])
+        for id, bookmark in server.bookmarks.items():
+            self.assertEqual(json.loads(client.get(f"/api/bookmarks/{id}"))["title"], f"Article {id}")
+            annotations = json.loads(client.get(f"/api/bookmarks/{id}/annotations"))
+            article = client.get(f"/api/bookmarks/{id}/article").decode("utf-8")
+            self.assertEqual(
+                [a["id"] for a in annotations], [a.id for a in extract_readeck_annotations(article)]
+            )
+        self.assertEqual(server.requests["/api/bookmarks/{id}/article"], 3)
+        self.assertEqual(dict(server.statuses), {200: 10})
+
+    def test_rate_limit_and_errors(self):
+        server, client = self.serve(rate_limit=1, retry_after=7)
+        client.get("/api/bookmarks/b00000")
+        with self.assertRaises(HTTPError) as cm:
+            client.get("/api/bookmarks/b00000")
+        self.assertEqual(cm.exception.status, 429)
+        server.rate_limit = None
+        server.error_rate = 1.0
+        with self.assertRaises(HTTPError) as cm:
+            client.get("/api/bookmarks/b00000")
+        self.assertEqual(cm.exception.status, 500)
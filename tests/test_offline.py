@@ -0,0 +1,42 @@
+import json
+import shutil
+import tarfile
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.readeck_annotation_export.offline import iter_local_articles, iter_sources
+
+COMPLEX_EXAMPLE = Path(__file__).with_name("complex-example.html")
+BOOKMARK = {"id": "abc", "title": "Monads", "url": "https://example.org/monads", "authors": ["Rain"],
+            "labels": [], "site_name": "example.org", "published": "2025-02-10T00:00:00Z"}
+
+
+class TestOffline(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name) / "articles"
+        (self.dir / "more").mkdir(parents=True)
+        shutil.copy(COMPLEX_EXAMPLE, self.dir / "monads.html")
+        (self.dir / "monads.json").write_text(json.dumps(BOOKMARK), encoding="utf-8")
+        (self.dir / "more" / "plain.html").write_text("<section><p>no annotations</p></section>", encoding="utf-8")
+        (self.dir / "more" / "notes.txt").write_text("ignored", encoding="utf-8")
+        self.tarball = Path(tmp.name) / "articles.tar.gz"
+        with tarfile.open(self.tarball, "w:gz") as tar:
+            tar.add(self.dir, arcname="articles")
+
+    def test_sources(self):
+        for source in (self.dir, self.tarball, f"{self.dir}/**/*.html"):
+            with self.subTest(source=source):
+                articles = list(iter_sources([str(source)]))
+                self.assertEqual([a.id for a in articles], ["abc", "plain"])
+                self.assertEqual(articles[0].bookmark, BOOKMARK)
+                self.assertEqual(articles[1].bookmark["title"], "plain")
+
+    def test_extracts_annotations(self):
+        results = list(iter_local_articles([str(self.tarball), str(self.dir / "monads.html")], jobs=2))
+        self.assertEqual([(id, error) for id, _, error in results], [("abc", None), ("plain", None), ("abc", None)])
+        self.assertEqual(len(results[0][1]["annotations"]), 30)
+        self.assertEqual(results[0][1]["annotations"], results[2][1]["annotations"])
+        self.assertEqual(results[1][1]["annotations"], [])
@@ -0,0 +1,82 @@
+import io
+import json
+import unittest
+
+from src.readeck_annotation_export.render import JsonLinesRenderer, LogseqRenderer, MarkdownRenderer
+
+ARTICLE = {
+    "id": "abc",
+    "title": "Title",
+    "url": "https://example.org/post",
+    "authors": ["Ann", "Bob"],
+    "labels": ["pbt"],
+    "site_name": "example.org",
+    "published": "2024-03-02T10:00:00Z",
+    "annotations": [
+        {"text": "first\nsecond", "color": "yellow"},
+        {"text": "```\ncode\n```", "color": None},
+    ],
+}
+
+
+def render(renderer_class, articles):
+    out = io.StringIO()
+    renderer_class("http://localhost:8000/bookmarks/").write(out, articles)
+    return out.getvalue()
+
+
+class TestRenderers(unittest.TestCase):
+    def test_logseq(self):
+        self.assertEqual(
+            render(LogseqRenderer, [ARTICLE]),
+            "- ## 🔖 Articles\n"
+            "\t- [Title](http://localhost:8000/bookmarks/abc)\n"
+            "\t  collapsed:: true\n"
+            "\t  type:: [[Article]]\n"
+            "\t  url:: https://example.org/post\n"
+            "\t  author:: [[Ann]], [[Bob]]\n"
+            "\t  links:: [[Readeck]], [[pbt]], [[example.org]]\n"
+            "\t  date-published:: [[Mar 2nd, 2024]]\n"
+            "\t\t- background-color:: yellow\n"
+            "\t\t  > first\n"
+            "\t\t  > second\n"
+            "\t\t- None\n"
+            "\t\t  #+BEGIN_QUOTE\n"
+            "\t\t  ```\n"
+            "\t\t  code\n"
+            "\t\t  ```\n"
+            "\t\t  #+END_QUOTE\n",
+        )
+
+    def test_logseq_omits_empty_properties(self):
+        article = ARTICLE | {"authors": [], "labels": [], "site_name": "", "published": None, "annotations": []}
+        self.assertEqual(
+            render(LogseqRenderer, [article]),
+            "- ## 🔖 Articles\n"
+            "\t- [Title](http://localhost:8000/bookmarks/abc)\n"
+            "\t  collapsed:: true\n"
+            "\t  type:: [[Article]]\n"
+            "\t  url:: https://example.org/post\n"
+            "\t  links:: [[Readeck]]\n",
+        )
+
+    def test_markdown(self):
+        self.assertEqual(
+            render(MarkdownRenderer, [ARTICLE]),
+            "# Articles\n"
+            "\n## [Title](http://localhost:8000/bookmarks/abc)\n\n"
+            "- URL: https://example.org/post\n"
+            "- Authors: Ann, Bob\n"
+            "- Site: example.org\n"
+            "- Labels: pbt\n"
+            "- Published: 2024-03-02\n"
+            "\n> first\n> second\n"
+            "\n> ```\n> code\n> ```\n",
+        )
+
+    def test_jsonl(self):
+        lines = render(JsonLinesRenderer, [ARTICLE, ARTICLE | {"id": "def"}]).splitlines()
+        self.assertEqual(len(lines), 2)
+        record = json.loads(lines[1])
+        self.assertEqual(record["readeck_url"], "http://localhost:8000/bookmarks/def")
+        self.assertEqual(record["annotations"], ARTICLE["annotations"])
@@ -0,0 +1,178 @@
+import http.server
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+from mock_readeck import MockReadeck, generate_bookmarks
+from src.readeck_annotation_export.constants import MAX_REDIRECTS
+from src.readeck_annotation_export.http_client import HTTPError, ReadeckClient, proxy_for
+from src.readeck_annotation_export.scheduler import FetchScheduler, TokenBucket, parse_retry_after
+
+
+class TestScheduler(unittest.TestCase):
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        delays = [bucket.reserve() for _ in range(4)]
+        self.assertEqual(delays[:2], [0.0, 0.0])
+        self.assertAlmostEqual(delays[2], 0.1, places=2)
+        self.assertAlmostEqual(delays[3], 0.2, places=2)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("7"), 7.0)
+        later = datetime.now(timezone.utc) + timedelta(seconds=60)
+        self.assertAlmostEqual(parse_retry_after(format_datetime(later, usegmt=True)), 60, delta=2)
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertIsNone(parse_retry_after(None))
+
+    def test_backoff_honours_retry_after(self):
+        scheduler = FetchScheduler(backoff=1, max_backoff=4)
+        self.assertTrue(all(0 <= scheduler.backoff_delay(10) <= 4 for _ in range(100)))
+        self.assertEqual(scheduler.backoff_delay(0, retry_after=5), 5)
+
+    def test_concurrency_adapts(self):
+        scheduler = FetchScheduler(max_concurrency=8)
+        scheduler.record("/a", 0.01, 503)
+        self.assertEqual(scheduler.limit, 4)
+        scheduler.record("/a", 0.01, 503)  # within the cooldown
+        self.assertEqual(scheduler.limit, 4)
+        for _ in range(4):
+            scheduler.record("/a", 0.01, 200)
+        self.assertEqual(scheduler.limit, 5)
+        scheduler._last_decrease -= 10
+        for _ in range(10):
+            scheduler.record("/a", 1.0, 200)  # latency rises far above 10 ms
+        self.assertEqual(scheduler.limit, 2)
+
+
+class TestRetries(unittest.TestCase):
+    def serve(self, scheduler, **options):
+        server = MockReadeck(generate_bookmarks(1), **options).start()
+        self.addCleanup(server.stop)
+        client = ReadeckClient(server.url, {"Authorization": "Bearer token"}, scheduler=scheduler)
+        self.addCleanup(client.close)
+        return server, client
+
+    def test_server_errors_are_retried(self):
+        server, client = self.serve(FetchScheduler(retries=20, backoff=0.001), error_rate=0.5, seed=3)
+        for _ in range(5):
+            client.get("/api/bookmarks/b00000/article")
+        self.assertEqual(server.requests["/api/bookmarks/{id}/article"], 5 + server.statuses[500])
+        self.assertGreater(server.statuses[500], 0)
+
+    def test_retry_after_is_honoured(self):
+        server, client = self.serve(FetchScheduler(backoff=0.001), rate_limit=1, retry_after=1)
+        start = time.monotonic()
+        client.get("/api/bookmarks/b00000")
+        client.get("/api/bookmarks/b00000")
+        self.assertGreaterEqual(time.monotonic() - start, 1.0)
+        self.assertEqual(server.statuses[429], 1)
+
+    def test_retries_wait_for_a_new_slot(self):
+        scheduler = FetchScheduler(max_concurrency=1, retries=2, backoff=0.001)
+        in_flight = []
+        slot = scheduler.slot
+
+        def counting_slot():
+            in_flight.append(scheduler._in_flight)
+            return slot()
+
+        scheduler.slot = counting_slot
+        server, client = self.serve(scheduler, error_rate=1.0)
+        with self.assertRaises(HTTPError):
+            client.get("/api/bookmarks/b00000")
+        # the slot of a failed attempt is released before the backoff
+        self.assertEqual(in_flight, [0, 0, 0])
+
+    def test_gives_up_after_retries(self):
+        server, client = self.serve(FetchScheduler(retries=2, backoff=0.001), error_rate=1.0)
+        with self.assertRaises(HTTPError) as cm:
+            client.get("/api/bookmarks/b00000")
+        self.assertEqual(cm.exception.status, 500)
+        self.assertEqual(server.statuses[500], 3)
+
+
+
+class Redirector(http.server.BaseHTTPRequestHandler):
+    """Redirects requests under /old/ to `target` (which defaults to the server itself).
+
+    Other requests are answered with the Authorization header they carried; everything received
+    is recorded.
+    """
+
+    target = ""
+    received: list[tuple[str, dict[str, str]]] = []
+
+    def do_GET(self):
+        self.received.append((self.path, dict(self.headers)))
+        if "/old/" in self.path:
+            self.send_response(301)
+            self.send_header("Location", self.target + self.path.replace("/old/", "/", 1))
+            body = b""
+        else:
+            self.send_response(200)
+            body = self.headers.get("Authorization", "").encode()
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestRedirectsAndProxies(unittest.TestCase):
+    def redirector(self, target: str = "") -> tuple[str, type[Redirector]]:
+        handler = type("Handler", (Redirector,), {"target": target, "received": []})
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f"http://127.0.0.1:{server.server_address[1]}", handler
+
+    def client(self, url: str) -> ReadeckClient:
+        client = ReadeckClient(url, {"Authorization": "Bearer token"})
+        self.addCleanup(client.close)
+        return client
+
+    def test_redirects_are_followed(self):
+        url, handler = self.redirector()
+        self.assertEqual(self.client(url).get("/old/api/bookmarks"), b"Bearer token")
+        self.assertEqual([path for path, _ in handler.received], ["/old/api/bookmarks", "/api/bookmarks"])
+
+    def test_credentials_are_not_sent_to_other_origins(self):
+        server = MockReadeck(generate_bookmarks(1)).start()
+        self.addCleanup(server.stop)
+        url, handler = self.redirector(server.url)
+        with self.assertRaises(HTTPError) as cm:
+            self.client(url).get("/old/api/bookmarks/b00000/article")
+        self.assertEqual(handler.received[0][1]["Authorization"], "Bearer token")
+        self.assertEqual(cm.exception.status, 401)
+        self.assertEqual(server.requests["/api/bookmarks/{id}/article"], 1)
+
+    def test_redirect_loops_are_cut_off(self):
+        url, handler = self.redirector()
+        path = "/old" * (MAX_REDIRECTS + 1) + "/api/bookmarks"
+        with self.assertRaises(HTTPError) as cm:
+            self.client(url).get(path)
+        self.assertEqual(cm.exception.status, 301)
+        self.assertEqual(len(handler.received), MAX_REDIRECTS)
+
+    def test_plain_http_goes_through_the_proxy(self):
+        proxy, handler = self.redirector()
+        with mock.patch.dict(os.environ, {"http_proxy": proxy, "no_proxy": ""}):
+            body = self.client("http://readeck.invalid").get("/api/bookmarks")
+        self.assertEqual(body, b"Bearer token")
+        self.assertEqual(handler.received[0][0], "http://readeck.invalid/api/bookmarks")
+
+    def test_proxy_settings(self):
+        with mock.patch.dict(os.environ, {"https_proxy": "user:secret@proxy:3128", "no_proxy": "local.test"}):
+            proxy = proxy_for("https://readeck.example/api")
+            self.assertEqual((proxy.hostname, proxy.port, proxy.username), ("proxy", 3128, "user"))
+            self.assertIsNone(proxy_for("https://local.test/api"))
+            self.assertIsNone(proxy_for("http://readeck.example/api"))
+        with mock.patch.dict(os.environ, {"https_proxy": "socks5://proxy:1080", "no_proxy": ""}):
+            with self.assertRaisesRegex(ValueError, "only http:// proxies"):
+                proxy_for("https://readeck.example/api")
@@ -0,0 +1,38 @@
+import os
+import unittest
+from unittest import mock
+
+from mock_readeck import MockReadeck, generate_bookmarks
+from src.readeck_annotation_export import core
+from src.readeck_annotation_export.serve import ExportService
+
+
+class TestExportService(unittest.TestCase):
+    def setUp(self):
+        self.server = MockReadeck(generate_bookmarks(3)).start()
+        self.addCleanup(self.server.stop)
+        environ = mock.patch.dict(os.environ, READECK_URL=self.server.url, READECK_AUTH_TOKEN="token")
+        environ.start()
+        self.addCleanup(environ.stop)
+        core.configure_client()
+        self.service = ExportService(jobs=2)
+        self.addCleanup(self.service.close)
+
+    def test_unchanged_articles_are_not_downloaded_again(self):
+        ids = sorted(self.server.bookmarks)
+        first, failed = self.service.export(ids, "jsonl")
+        self.assertEqual(failed, [])
+        self.assertEqual(len(first.splitlines()), 3)
+        second, _ = self.service.export(ids, "jsonl")
+        self.assertEqual(second, first)
+        self.assertEqual(self.server.requests["/api/bookmarks/{id}/article"], 3)
+        self.assertEqual(self.server.requests["/api/bookmarks/{id}"], 6)
+
+        self.server.bookmarks[ids[0]].bookmark["updated"] = "2025-01-01T00:00:00Z"
+        self.service.export(ids, "jsonl")
+        self.assertEqual(self.server.requests["/api/bookmarks/{id}/article"], 4)
+
+    def test_failed_articles_are_reported(self):
+        output, failed = self.service.export(["b00000", "missing"], "logseq")
+        self.assertEqual(failed, ["missing"])
+        self.assertIn("[Article b00000]", output)
@@ -0,0 +1,37 @@
+import json
+import unittest
+
+from src.readeck_annotation_export import stats
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        stats.reset()
+
+    def tearDown(self):
+        stats.reset()
+
+    def test_series_and_hit_rates(self):
+        stats.observe("annotations per article", 2)
+        stats.observe("annotations per article", 4)
+        with stats.timer("parse"):
+            pass
+        stats.count("markdown cache hits", 3)
+        stats.count("markdown cache misses")
+        stats.count("response cache misses")
+        report = stats.report()
+        self.assertEqual(report["series"]["annotations per article"]["mean"], 3)
+        self.assertEqual(report["series"]["annotations per article"]["max"], 4)
+        self.assertEqual(report["series"]["parse"]["unit"], "s")
+        self.assertEqual(report["hit_rates"], {"markdown cache": 0.75, "response cache": 0.0})
+        json.dumps(report)
+        self.assertIn("markdown cache hit rate: 75.0%", stats.format_report())
+
+    def test_merge_snapshot(self):
+        stats.count("article downloads")
+        stats.add_time("parse", 0.5)
+        snapshot = stats.snapshot()
+        stats.merge(snapshot)
+        self.assertEqual(stats.counters["article downloads"], 2)
+        self.assertEqual(stats.series["parse"].count, 2)
+        self.assertEqual(stats.series["parse"].total, 1.0)
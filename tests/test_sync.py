@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from mock_readeck import MockBookmark, MockReadeck, generate_bookmarks
+from src.readeck_annotation_export import core
+from src.readeck_annotation_export.sync import changed_bookmarks, export_changes, load_state
+
+
+class TestSync(unittest.TestCase):
+    def setUp(self):
+        self.server = MockReadeck(generate_bookmarks(3)).start()
+        self.addCleanup(self.server.stop)
+        environ = mock.patch.dict(os.environ, READECK_URL=self.server.url, READECK_AUTH_TOKEN="token")
+        environ.start()
+        self.addCleanup(environ.stop)
+        core.configure_client()
+        self.addCleanup(core.readeck_client().close)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.state = load_state(Path(tmp.name) / "sync-state.json")
+
+    def sync(self, full: bool = False) -> list[dict]:
+        return list(export_changes(self.state, changed_bookmarks(self.state, full=full), jobs=2))
+
+    def test_only_changed_bookmarks_are_exported(self):
+        self.assertEqual([a["id"] for a in self.sync()], ["b00000", "b00001", "b00002"])
+        self.assertEqual(self.sync(), [])
+        self.server.bookmarks["b00001"].bookmark["updated"] = "2025-01-01T00:00:00Z"
+        self.assertEqual([a["id"] for a in self.sync()], ["b00001"])
+
+    def test_bookmark_without_annotations_is_exported_once_emptied(self):
+        self.sync()
+        self.server.bookmarks["b00001"] = MockBookmark.create("b00001", "<p>plain</p>", "2025-01-01T00:00:00Z")
+        articles = self.sync()
+        self.assertEqual([(a["id"], a["annotations"]) for a in articles], [("b00001", [])])
+        self.assertNotIn("b00001", self.state["exported"])
+        self.server.bookmarks["b00001"].bookmark["updated"] = "2025-01-02T00:00:00Z"
+        self.assertEqual(self.sync(), [])
+
+    def test_deleted_bookmarks_are_removed_from_the_state(self):
+        self.sync()
+        del self.server.bookmarks["b00002"]
+        self.sync(full=True)
+        self.assertEqual(sorted(self.state["bookmarks"]), ["b00000", "b00001"])
+        self.assertEqual(self.state["exported"], ["b00000", "b00001"])
@@ -0,0 +1,101 @@
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+from src.readeck_annotation_export.render import LogseqRenderer
+from src.readeck_annotation_export.update import update_page
+
+
+def article(id, *texts):
+    return {
+        "id": id,
+        "title": f"Title {id}",
+        "url": f"https://example.org/{id}",
+        "authors": [],
+        "labels": [],
+        "site_name": "",
+        "annotations": [{"text": text, "color": "yellow"} for text in texts],
+    }
+
+
+class TestUpdatePage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "page.md"
+        self.renderer = LogseqRenderer("http://localhost:8000/bookmarks")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def render(self, *articles):
+        out = io.StringIO()
+        for a in articles:
+            self.renderer.write_article(out, a)
+        return out.getvalue()
+
+    def test_creates_missing_page(self):
+        update_page(self.path, [article("a", "A")], self.renderer)
+        self.assertEqual(self.path.read_text(encoding="utf-8"), "- ## 🔖 Articles\n" + self.render(article("a", "A")))
+
+    def test_replaces_changed_and_appends_new_articles(self):
+        edited = self.render(article("b", "B")) + "\t\t- my own note\n"
+        self.path.write_text(
+            "- intro\n- ## 🔖 Articles\n" + self.render(article("a", "A")) + edited + "- outro\n",
+            encoding="utf-8",
+        )
+        update_page(self.path, [article("c", "C"), article("a", "A2"), article("b", "B")], self.renderer)
+        self.assertEqual(
+            self.path.read_text(encoding="utf-8"),
+            "- intro\n- ## 🔖 Articles\n" + self.render(article("a", "A2")) + edited
+            + self.render(article("c", "C")) + "- outro\n",
+        )
+
+    def test_children_added_to_changed_article_are_kept(self):
+        notes = "\t\t- my own note\n\t\t\t- nested note\n"
+        self.path.write_text("- ## 🔖 Articles\n" + self.render(article("a", "A", "B")) + notes, encoding="utf-8")
+        update_page(self.path, [article("a", "A", "C")], self.renderer)
+        self.assertEqual(
+            self.path.read_text(encoding="utf-8"), "- ## 🔖 Articles\n" + self.render(article("a", "A", "C")) + notes
+        )
+
+    def test_notes_nested_under_annotations_are_kept(self):
+        def with_note(page):
+            return page.replace("\t\t  > B\n", "\t\t  > B\n\t\t\t- note on B\n\t\t\t  second line\n")
+
+        self.path.write_text("- ## 🔖 Articles\n" + with_note(self.render(article("a", "B", "A"))), encoding="utf-8")
+        mtime = self.path.stat().st_mtime_ns
+        update_page(self.path, [article("a", "B", "A")], self.renderer)
+        self.assertEqual(self.path.stat().st_mtime_ns, mtime)
+
+        update_page(self.path, [article("a", "A", "B", "C")], self.renderer)
+        self.assertEqual(
+            self.path.read_text(encoding="utf-8"),
+            "- ## 🔖 Articles\n" + with_note(self.render(article("a", "A", "B", "C"))),
+        )
+
+    def test_notes_of_removed_annotations_are_kept(self):
+        note = "\t\t\t- note on B\n"
+        self.path.write_text("- ## 🔖 Articles\n" + self.render(article("a", "A", "B")) + note, encoding="utf-8")
+        update_page(self.path, [article("a", "A")], self.renderer)
+        self.assertEqual(
+            self.path.read_text(encoding="utf-8"),
+            "- ## 🔖 Articles\n" + self.render(article("a", "A")) + "\t\t- note on B\n",
+        )
+
+    def test_only_blocks_under_the_articles_heading_are_updated(self):
+        reading_list = "- ## Reading list\n\t- [Some blog](http://localhost:8000/bookmarks/b)\n\t\t- later\n"
+        self.path.write_text(
+            "- ## 🔖 Articles\n" + self.render(article("a", "A")) + reading_list, encoding="utf-8"
+        )
+        update_page(self.path, [article("b", "B")], self.renderer)
+        self.assertEqual(
+            self.path.read_text(encoding="utf-8"),
+            "- ## 🔖 Articles\n" + self.render(article("a", "A"), article("b", "B")) + reading_list,
+        )
+
+    def test_unchanged_page_is_not_rewritten(self):
+        self.path.write_text("- ## 🔖 Articles\n" + self.render(article("a", "A")), encoding="utf-8")
+        mtime = self.path.stat().st_mtime_ns
+        update_page(self.path, [article("a", "A")], self.renderer)
+        self.assertEqual(self.path.stat().st_mtime_ns, mtime)
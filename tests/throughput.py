@@ -0,0 +1,83 @@
+"""End-to-end export throughput against the mock Readeck server (see mock_readeck.py).
+
+    python tests/throughput.py --batch-sizes 10 100 --jobs 1 4 16 --latency 0.02 --rate-limit 200
+
+Exports every batch size with every number of concurrent requests, each from a cold client,
+and reports articles per second, requests, and the statuses the server answered with.
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+from mock_readeck import add_server_arguments, server_from_arguments
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+if str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+from readeck_annotation_export import core, stats  # noqa: E402
+from readeck_annotation_export.constants import DEFAULT_RETRIES  # noqa: E402
+from readeck_annotation_export.scheduler import FetchScheduler  # noqa: E402
+
+
+def export_batch(ids: list[str], jobs: int, rate: float | None = None, retries: int = DEFAULT_RETRIES) -> dict:
+    """Export `ids` like the export command does and return the timing and counters of the run."""
+    core.configure_client(scheduler=FetchScheduler(max_concurrency=jobs, rate=rate, retries=retries))
+    stats.reset()
+    start = time.perf_counter()
+    out = io.StringIO()
+    core.write_articles(out, core.skip_failed(core.iter_articles(ids, jobs=jobs)))
+    elapsed = time.perf_counter() - start
+    core.readeck_client().close()
+    return {
+        "articles": len(ids),
+        "failed": stats.counters["failed articles"],
+        "retries": stats.counters["request retries"],
+        "concurrency reductions": stats.counters["concurrency reductions"],
+        "seconds": elapsed,
+        "articles/s": len(ids) / elapsed if elapsed else 0.0,
+        "output bytes": len(out.getvalue()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 50], help="articles per export")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 4, 8, 16], help="concurrent requests")
+    parser.add_argument("--rate", type=float, help="client-side limit of requests per second")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="client-side retries per request")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+    args.bookmarks = max(args.bookmarks, *args.batch_sizes)
+
+    results = []
+    with server_from_arguments(args) as server:
+        os.environ["READECK_URL"] = server.url
+        os.environ["READECK_AUTH_TOKEN"] = server.token
+        ids = sorted(server.bookmarks)
+        for batch_size in args.batch_sizes:
+            for jobs in args.jobs:
+                server.requests.clear()
+                server.statuses.clear()
+                result = {"batch size": batch_size, "jobs": jobs}
+                result |= export_batch(ids[:batch_size], jobs, args.rate, args.retries)
+                result["requests"] = sum(server.requests.values())
+                result["statuses"] = {str(status): n for status, n in sorted(server.statuses.items())}
+                results.append(result)
+                print(
+                    f"batch {batch_size:5d}, jobs {jobs:3d}: {result['articles/s']:8.1f} articles/s, "
+                    f"{result['seconds']:7.2f} s, {result['failed']} failed, {result['retries']} retries, "
+                    f"{result['requests']} requests, statuses {result['statuses']}"
+                )
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()